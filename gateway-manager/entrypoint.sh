@@ -48,6 +48,11 @@ function show_help_app {
 
     start_app:
         Starts the gateway tenant home app.
+        Uses a preforking WSGI server unless WEB_SERVER_MODE is "development".
+
+    build_static:
+        Builds the fingerprinted (content hashed) and compressed copies
+        of the static files. "start_app" builds them too.
     """
 }
 
@@ -71,6 +76,29 @@ function show_help_keycloak {
                           {*email_theme=abc}
 
 
+    bootstrap_realm:
+        Adds a new realm with its clients, admin and initial users in one call.
+        Adds the missing parts to an existing realm with one partial import.
+
+        Usage:  bootstrap_realm {realm}
+                                {*description=abc}
+                                {*login_theme=abc}
+                                {*account_theme=abc}
+                                {*admin_theme=abc}
+                                {*email_theme=abc}
+                                {*confidential_clients=client-1,client-2}
+                                {*public_clients=client-3,client-4}
+                                {*admin=username} {*admin_password=abc} {*temporary_password=true}
+                                {*users_file=path}
+                                {*overwrite=true}
+
+
+    bootstrap_realms:
+        Bootstraps the realms listed in a file (one name or JSON object per line).
+
+        Usage:  bootstrap_realms {file} {*concurrency=10} {*bootstrap_realm arguments}
+
+
     add_admin:
         Adds or updates an admin user to an existing realm.
 
@@ -91,6 +119,22 @@ function show_help_keycloak {
         Usage:  add_user_group {realm} {username} {group_name}
 
 
+    add_users:
+        Adds or updates the users listed in a CSV or JSONL file to an existing realm.
+        CSV columns: username, email, firstName, lastName, enabled,
+                     password, temporary_password, groups (separated by ";")
+
+        Usage:  add_users {realm} {file}
+                          {*batch_size=500} {*concurrency=10} {*format=csv|jsonl}
+
+
+    export_users:
+        Exports the users of an existing realm as JSONL or CSV (standard output by default).
+
+        Usage:  export_users {realm} {*output=file} {*format=csv|jsonl}
+                             {*expand=groups,roles} {*page_size=500} {*concurrency=10}
+
+
     add_confidential_client | add_oidc_client:
         Adds a confidential client to an existing realm.
         Required for any realm that will use OIDC for authentication.
@@ -140,6 +184,13 @@ function show_help_kong {
         using the service definition in ${SERVICES_PATH:-/code/service} directory.
 
         Usage:  add_service {service} {realm} {oidc-client}
+                            {*async=true} {*concurrency=10} {*force=true}
+
+        Add in several realms:  add_service {service} {realm-1,realm-2} {oidc-client}
+                                add_service {service} "" {oidc-client} realms_file={path}
+
+        Unchanged services (same configuration hash tag) are skipped unless "force=true".
+        The realm is positional, leave it empty ("") to take the realms only from "realms_file".
 
 
     remove_service:
@@ -156,6 +207,10 @@ function show_help_kong {
         using the solution definition in ${SOLUTION_PATH:-/code/solution} directory.
 
         Usage:  add_solution {solution} {realm} {oidc-client}
+                             {*async=true} {*concurrency=10} {*force=true}
+
+        Add in several realms:  add_solution {solution} {realm-1,realm-2} {oidc-client}
+                                add_solution {solution} "" {oidc-client} realms_file={path}
 
 
     remove_solution:
@@ -165,6 +220,46 @@ function show_help_kong {
         Usage:  remove_solution {solution} {realm}
 
         Remove in all realms:  remove_solution {solution}
+
+
+    remove_realm:
+        Removes all the routes of a realm (and their OIDC plugins) across all services in Kong.
+
+        Usage:  remove_realm {realm} {*concurrency=10}
+
+        Remove several realms:  remove_realm {realm-1,realm-2}
+                                remove_realm realms_file={path}
+
+
+    reconcile_kong:
+        Compares the Kong current state with the app, service and solution
+        definitions and applies only the differences.
+        Uses all the app and solution definitions if none is indicated.
+        The realm is positional, leave it empty ("") to indicate the oidc-client
+        with the realms only in "realms_file".
+
+        Usage:  reconcile_kong {*realm-1,realm-2} {*oidc-client}
+                               {*apps=app-1,app-2}
+                               {*services=service-1,service-2}
+                               {*solutions=solution-1,solution-2}
+                               {*realms_file=path}
+                               {*dry_run=true}
+
+
+    compile_kong:
+        Renders the app, service and solution definitions for the given realms
+        as a Kong declarative configuration (DB-less mode).
+        Uses all the app and solution definitions if none is indicated.
+        The realm is positional, leave it empty ("") to indicate the oidc-client
+        with the realms only in "realms_file".
+
+        Usage:  compile_kong {*realm-1,realm-2} {*oidc-client}
+                             {*apps=app-1,app-2}
+                             {*services=service-1,service-2}
+                             {*solutions=solution-1,solution-2}
+                             {*realms_file=path}
+                             {*output=kong.json}
+                             {*push=true}
     """
 }
 
@@ -295,10 +390,23 @@ function show_help_env {
 
         ELASTICSEARCH_HOST         ${ELASTICSEARCH_HOST:-}
 
+        HTTP_POOL_SIZE             ${HTTP_POOL_SIZE:-}
+        HTTP_KEEP_ALIVE            ${HTTP_KEEP_ALIVE:-}
+        HTTP_CONNECT_TIMEOUT       ${HTTP_CONNECT_TIMEOUT:-}
+        HTTP_READ_TIMEOUT          ${HTTP_READ_TIMEOUT:-}
+
+        METRICS_FILE               ${METRICS_FILE:-}
+
         KEYCLOAK_INTERNAL          ${KEYCLOAK_INTERNAL:-}
         KEYCLOAK_MASTER_REALM      ${KEYCLOAK_MASTER_REALM:-}
+        KEYCLOAK_CACHE_RETRIES     ${KEYCLOAK_CACHE_RETRIES:-}
+        KEYCLOAK_CONCURRENCY       ${KEYCLOAK_CONCURRENCY:-}
+        KEYCLOAK_LOOKUP_TTL        ${KEYCLOAK_LOOKUP_TTL:-}
+        KEYCLOAK_SECRET_TTL        ${KEYCLOAK_SECRET_TTL:-}
+        KEYCLOAK_REALM_TTL         ${KEYCLOAK_REALM_TTL:-}
 
         KONG_INTERNAL              ${KONG_INTERNAL:-}
+        KONG_CONCURRENCY           ${KONG_CONCURRENCY:-}
 
         PUBLIC_REALM               ${PUBLIC_REALM:-}
 
@@ -306,6 +414,19 @@ function show_help_env {
 
         WEB_SERVER_PORT            ${WEB_SERVER_PORT:-}
         WEB_SERVICE_NAME           ${WEB_SERVICE_NAME:-}
+        STATIC_PATH                ${STATIC_PATH:-}
+        STATIC_BUILD_PATH          ${STATIC_BUILD_PATH:-}
+        WEB_CACHE_TTL              ${WEB_CACHE_TTL:-}
+        WEB_REFRESH_INTERVAL       ${WEB_REFRESH_INTERVAL:-}
+        WEB_KONG_TIMEOUT           ${WEB_KONG_TIMEOUT:-}
+        WEB_KEYCLOAK_TIMEOUT       ${WEB_KEYCLOAK_TIMEOUT:-}
+        WEB_LOOKUP_WORKERS         ${WEB_LOOKUP_WORKERS:-}
+        WEB_METRICS_INTERVAL       ${WEB_METRICS_INTERVAL:-}
+        WEB_SERVER_MODE            ${WEB_SERVER_MODE:-}
+        WEB_WORKERS                ${WEB_WORKERS:-}
+        WEB_THREADS                ${WEB_THREADS:-}
+        WEB_TIMEOUT                ${WEB_TIMEOUT:-}
+        WEB_GRACEFUL_TIMEOUT       ${WEB_GRACEFUL_TIMEOUT:-}
 
     """
 }
@@ -343,6 +464,14 @@ case "${1:-}" in
         python /code/src/manage_keycloak.py ADD_REALM "${@:2}"
     ;;
 
+    bootstrap_realm )
+        python /code/src/manage_keycloak.py BOOTSTRAP_REALM "${@:2}"
+    ;;
+
+    bootstrap_realms )
+        python /code/src/manage_keycloak.py BOOTSTRAP_REALMS "${@:2}"
+    ;;
+
     add_admin )
         python /code/src/manage_keycloak.py ADD_ADMIN "${@:2}"
     ;;
@@ -355,6 +484,14 @@ case "${1:-}" in
         python /code/src/manage_keycloak.py ADD_USER_GROUP "${@:2}"
     ;;
 
+    add_users )
+        python /code/src/manage_keycloak.py ADD_USERS "${@:2}"
+    ;;
+
+    export_users )
+        python /code/src/manage_keycloak.py EXPORT_USERS "${@:2}"
+    ;;
+
     add_confidential_client | add_oidc_client )
         python /code/src/manage_keycloak.py ADD_CONFIDENTIAL_CLIENT "${@:2}"
     ;;
@@ -400,6 +537,18 @@ case "${1:-}" in
         python /code/src/manage_kong.py SOLUTION REMOVE "${@:2}"
     ;;
 
+    remove_realm )
+        python /code/src/manage_kong.py REALM REMOVE "${@:2}"
+    ;;
+
+    reconcile_kong )
+        python /code/src/manage_kong.py RECONCILE "${@:2}"
+    ;;
+
+    compile_kong )
+        python /code/src/manage_kong.py COMPILE "${@:2}"
+    ;;
+
 
     # --------------------------------------------------------------------------
     # Kafka
@@ -489,6 +638,10 @@ case "${1:-}" in
         python /code/src/manage_home_app.py START_APP
     ;;
 
+    build_static )
+        python /code/src/manage_home_app.py BUILD_STATIC
+    ;;
+
     # --------------------------------------------------------------------------
     # Generic
     # --------------------------------------------------------------------------
@@ -21,7 +21,7 @@
 import jwt
 import sys
 
-from helpers import request, get_logger, print_json
+from helpers import request, get_logger, log_connection_stats, print_json
 from settings import BASE_HOST
 
 
@@ -73,3 +73,4 @@ if __name__ == '__main__':
 
     token = sys.argv[1]
     check_jwt(token)
+    log_connection_stats(logger)
@@ -18,14 +18,39 @@
 
 import logging
 import json
-from string import Template
+import os
+import time
+from functools import lru_cache
+from string import Formatter, Template
+from threading import Lock
 from typing import List, Tuple
+from urllib.parse import urlsplit
 
 import coloredlogs
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 
-from settings import DEBUG, KC_ADMIN_REALM, KONG_PUBLIC_REALM
+from metrics import REGISTRY, get_cache_metrics, observe_request
+from settings import (
+    DEBUG,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_KEEP_ALIVE,
+    HTTP_POOL_SIZE,
+    HTTP_READ_TIMEOUT,
+    KC_ADMIN_REALM,
+    KONG_PUBLIC_REALM,
+)
+
+# pooled keep-alive sessions by base url
+_SESSIONS = {}
+_SESSIONS_LOCK = Lock()
+
+# compiled JSON templates by path: (mtime, size, compiled template)
+_TEMPLATES = {}
+_TEMPLATES_LOCK = Lock()
+_TEMPLATES_STATS = {'hits': 0, 'misses': 0}
 
 
 def check_realm(realm):
@@ -44,13 +69,59 @@ def identity(obj):
     return obj
 
 
-def request(*args, **kwargs):
+def get_session(url):
+    # one session (connection pool) per base url, reused by all the calls
+    base_url = '{0.scheme}://{0.netloc}'.format(urlsplit(url))
+
+    with _SESSIONS_LOCK:
+        if base_url not in _SESSIONS:
+            session = requests.Session()
+            session.mount(base_url, HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+            if not HTTP_KEEP_ALIVE:
+                session.headers['Connection'] = 'close'
+            _SESSIONS[base_url] = session
+        return _SESSIONS[base_url]
+
+
+def get_connection_stats():
+    # number of requests and new connections by base url
+    stats = {}
+    for base_url, session in list(_SESSIONS.items()):
+        requests_count = connections_count = 0
+        for adapter in session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                if pool:
+                    requests_count += pool.num_requests
+                    connections_count += pool.num_connections
+        stats[base_url] = {
+            'requests': requests_count,
+            'connections': connections_count,
+            'reused': max(requests_count - connections_count, 0),
+        }
+    return stats
+
+
+def log_connection_stats(logger):
+    for base_url, stats in get_connection_stats().items():
+        logger.debug(
+            f'{base_url}: {stats["requests"]} requests,'
+            f' {stats["connections"]} new connections, {stats["reused"]} reused'
+        )
+
+
+def request(method, url, *args, **kwargs):
     _logger = get_logger('request')
 
     ignore_404 = kwargs.pop('ignore_404', False)
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    start = time.monotonic()
+    status = 'error'
     try:
         # don't verify SSL certificate internally
-        res = requests.request(*args, **kwargs, verify=False)
+        res = get_session(url).request(method, url, *args, **kwargs, verify=False)
+        status = res.status_code
         res.raise_for_status()
         if res.status_code != 204:
             data = res.json()
@@ -61,34 +132,163 @@ def request(*args, **kwargs):
         __handle_exception(_logger, he, res, ignore_404)
     except Exception as e:
         __handle_exception(_logger, e)
+    finally:
+        observe_request(url, method, status, start)
+
+
+def get_async_client():
+    # async connection pool, to be used as context manager
+    return httpx.AsyncClient(
+        verify=False,  # don't verify SSL certificate internally
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE if HTTP_KEEP_ALIVE else 0,
+        ),
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+async def async_request(client, method, url, **kwargs):
+    _logger = get_logger('request')
+
+    ignore_404 = kwargs.pop('ignore_404', False)
+    start = time.monotonic()
+    status = 'error'
+    try:
+        res = await client.request(method, url, **kwargs)
+        status = res.status_code
+        res.raise_for_status()
+        if res.status_code != 204:
+            data = res.json()
+            print_json(_logger.verbose, data)
+            return data
+        return None
+    except httpx.HTTPStatusError as he:
+        __handle_exception(_logger, he, res, ignore_404)
+    except Exception as e:
+        __handle_exception(_logger, e)
+    finally:
+        observe_request(url, method, status, start)
+
+
+@lru_cache(maxsize=1024)
+def _get_template_fields(template_str):
+    return frozenset(field for _, field, _, _ in Formatter().parse(template_str) if field)
 
 
 def fill_template(template_str, mapping):
     # take only the required values for formatting
+    fields = _get_template_fields(template_str)
     swaps = {
         k: v
         for k, v in mapping.items()
-        if ('{%s}' % k) in template_str
+        if k in fields
     }
     return template_str.format(**swaps)
 
 
+def _compile_json(data):
+    # only the strings with placeholders are kept as templates
+    if isinstance(data, str):
+        return Template(data) if '$' in data else data
+    if isinstance(data, dict):
+        return {_compile_json(k): _compile_json(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [_compile_json(item) for item in data]
+    return data
+
+
+def _render_json(node, mapping):
+    # returns a new structure on each call, the compiled one is never exposed
+    if isinstance(node, Template):
+        return node.safe_substitute(mapping) if mapping else node.template
+    if isinstance(node, dict):
+        return {_render_json(k, mapping): _render_json(v, mapping) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_render_json(item, mapping) for item in node]
+    return node
+
+
+def _load_template(json_file_path):
+    # the file is read and parsed again only if it was modified
+    stat = os.stat(json_file_path)
+    with _TEMPLATES_LOCK:
+        cached = _TEMPLATES.get(json_file_path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            _TEMPLATES_STATS['hits'] += 1
+            return cached[2]
+
+    with open(json_file_path) as _f:
+        content = _f.read().replace('\n', '')
+    try:
+        template = (True, _compile_json(json.loads(content)))
+    except ValueError:
+        # placeholders outside of the JSON strings, substituted in the raw content
+        template = (False, Template(content))
+
+    with _TEMPLATES_LOCK:
+        _TEMPLATES_STATS['misses'] += 1
+        _TEMPLATES[json_file_path] = (stat.st_mtime_ns, stat.st_size, template)
+    return template
+
+
 def load_json_file(json_file_path, mapping=None):
     _logger = get_logger('json')
 
     try:
-        with open(json_file_path) as _f:
-            content = _f.read().replace('\n', '')
-            if mapping:
-                content = Template(content).safe_substitute(mapping)
-            data = json.loads(content)
-        return data
+        is_parsed, template = _load_template(json_file_path)
+        if is_parsed:
+            return _render_json(template, mapping)
+        return json.loads(template.safe_substitute(mapping) if mapping else template.template)
     except Exception as e:
         __handle_exception(_logger, e)
 
 
+def clear_template_cache():
+    with _TEMPLATES_LOCK:
+        _TEMPLATES.clear()
+    _get_template_fields.cache_clear()
+
+
+def get_template_stats():
+    fields_info = _get_template_fields.cache_info()
+    return {
+        'json': {**_TEMPLATES_STATS, 'size': len(_TEMPLATES)},
+        'fill': {'hits': fields_info.hits, 'misses': fields_info.misses, 'size': fields_info.currsize},
+    }
+
+
+@REGISTRY.collector
+def _get_helpers_metrics():
+    connections = get_connection_stats()
+    return [
+        *get_cache_metrics({f'{name}_templates': stats for name, stats in get_template_stats().items()}),
+        (
+            'gwm_http_connections_total', 'counter', 'New HTTP connections by backend.',
+            [({'backend': urlsplit(url).netloc}, stats['connections']) for url, stats in connections.items()],
+        ),
+    ]
+
+
+def log_template_stats(logger):
+    for name, stats in get_template_stats().items():
+        logger.debug(f'{name} templates: {stats["hits"]} hits, {stats["misses"]} misses, {stats["size"]} cached')
+
+
+def _mask_secrets(data):
+    # the secrets are never logged
+    if isinstance(data, dict):
+        return {
+            k: '********' if v and 'secret' in str(k).lower() else _mask_secrets(v)
+            for k, v in data.items()
+        }
+    if isinstance(data, list):
+        return [_mask_secrets(item) for item in data]
+    return data
+
+
 def print_json(printer, data):
-    printer(json.dumps(data, indent=2))
+    printer(json.dumps(_mask_secrets(data), indent=2))
 
 
 def __handle_exception(logger, exception, res=None, ignore_404=False):
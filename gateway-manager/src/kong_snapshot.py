@@ -0,0 +1,224 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from collections import defaultdict
+
+from helpers import get_logger, request
+from settings import KONG_INTERNAL_URL
+
+# biggest page size allowed by the Kong admin API
+KONG_PAGE_SIZE = 1000
+
+LOGGER = get_logger('Kong')
+
+
+def get_all(url, request_fn=request, tags=None):
+    # walks the paginated list using the biggest page size,
+    # the list can be filtered by tags (comma separated, all of them must match)
+    items = []
+    next_url = f'{url}?size={KONG_PAGE_SIZE}'
+    if tags:
+        next_url += f'&tags={tags}'
+    while next_url:
+        res = request_fn(method='get', url=next_url)
+        next_url = res.get('next')
+        items += res.get('data', [])
+    return items
+
+
+class KongSnapshot:
+    '''
+    In memory copy of the Kong services, routes and plugins.
+
+    Loaded with one bulk read per entity type and indexed by service name,
+    route name, tag and realm. The manage functions keep it up to date after
+    each change so the lookups within a command never go back to Kong.
+    '''
+
+    def __init__(self, url=KONG_INTERNAL_URL, request_fn=request):
+        self.url = url
+        self.request_fn = request_fn
+        self.clear()
+
+    def clear(self):
+        self.services = {}  # id -> service
+        self.routes = {}    # id -> route
+        self.plugins = {}   # id -> plugin
+
+        self._service_names = {}                     # name -> service id
+        self._route_names = {}                       # name -> route id
+        self._service_routes = defaultdict(dict)     # service id -> route ids
+        self._service_plugins = defaultdict(dict)    # service id -> plugin ids
+        self._route_plugins = defaultdict(dict)      # route id -> plugin ids
+        self._tag_routes = defaultdict(dict)         # tag -> route ids
+        self._realm_routes = defaultdict(dict)       # realm -> route ids (untagged routes)
+
+    def load(self):
+        self.clear()
+        self.load_services()
+        self.load_routes()
+        for plugin in get_all(f'{self.url}/plugins', self.request_fn):
+            self.add_plugin(plugin)
+
+        LOGGER.debug(
+            f'Kong snapshot: {len(self.services)} services,'
+            f' {len(self.routes)} routes, {len(self.plugins)} plugins'
+        )
+        return self
+
+    def load_services(self):
+        self.services = {}
+        self._service_names = {}
+        for service in get_all(f'{self.url}/services', self.request_fn):
+            self.add_service(service)
+        return self
+
+    def load_routes(self):
+        # reloads the routes alone, enough to find the services by realm
+        self.routes = {}
+        self._route_names = {}
+        self._service_routes = defaultdict(dict)
+        self._tag_routes = defaultdict(dict)
+        self._realm_routes = defaultdict(dict)
+        for route in get_all(f'{self.url}/routes', self.request_fn):
+            self.add_route(route)
+        return self
+
+    # lookups
+
+    def get_service(self, name):
+        return self.services.get(self._service_names.get(name))
+
+    def get_route(self, name):
+        return self.routes.get(self._route_names.get(name))
+
+    def get_service_name(self, entity):
+        # name of the service linked to the route or plugin
+        service = self.services.get((entity.get('service') or {}).get('id'))
+        return service['name'] if service else None
+
+    def get_route_name(self, entity):
+        # name of the route linked to the plugin
+        route = self.routes.get((entity.get('route') or {}).get('id'))
+        return route['name'] if route else None
+
+    def get_service_routes(self, name):
+        service_id = self._service_names.get(name)
+        return [self.routes[i] for i in self._service_routes.get(service_id, {})]
+
+    def get_service_plugins(self, name):
+        # plugins linked to the service itself, not to any of its routes
+        service_id = self._service_names.get(name)
+        return [self.plugins[i] for i in self._service_plugins.get(service_id, {})]
+
+    def get_route_plugins(self, name):
+        route_id = self._route_names.get(name)
+        return [self.plugins[i] for i in self._route_plugins.get(route_id, {})]
+
+    def get_routes_by_tag(self, tag):
+        return [self.routes[i] for i in self._tag_routes.get(tag, {})]
+
+    def get_routes_by_realm(self, realm):
+        # realm routes are tagged with the realm,
+        # the old ones (without tags) have the realm as name suffix
+        route_ids = {**self._tag_routes.get(realm, {}), **self._realm_routes.get(realm, {})}
+        return [self.routes[i] for i in route_ids]
+
+    def get_services_by_realm(self, realm):
+        service_ids = {
+            (route.get('service') or {}).get('id')
+            for route in self.get_routes_by_realm(realm)
+        }
+        return [
+            service['name']
+            for service_id, service in self.services.items()
+            if service_id in service_ids
+        ]
+
+    # changes
+
+    def add_service(self, service):
+        self.services[service['id']] = service
+        self._service_names[service['name']] = service['id']
+
+    def add_route(self, route):
+        route_id = route['id']
+        self.routes[route_id] = route
+        if route.get('name'):
+            self._route_names[route['name']] = route_id
+
+        service_id = (route.get('service') or {}).get('id')
+        if service_id:
+            self._service_routes[service_id][route_id] = True
+
+        # json -> null will be returned as None
+        if route.get('tags') is not None:
+            for tag in route['tags']:
+                self._tag_routes[tag][route_id] = True
+        elif route.get('name') and '__' in route['name']:
+            realm = route['name'].rsplit('__', 1)[-1]
+            self._realm_routes[realm][route_id] = True
+
+    def add_plugin(self, plugin):
+        plugin_id = plugin['id']
+        self.plugins[plugin_id] = plugin
+
+        if plugin.get('route'):
+            self._route_plugins[plugin['route']['id']][plugin_id] = True
+        elif plugin.get('service'):
+            self._service_plugins[plugin['service']['id']][plugin_id] = True
+
+    def remove_service(self, name):
+        service_id = self._service_names.pop(name, None)
+        if not service_id:
+            return
+
+        for route_id in list(self._service_routes.get(service_id, {})):
+            self.remove_route(route_id)
+        for plugin_id in list(self._service_plugins.get(service_id, {})):
+            self.remove_plugin(plugin_id)
+        self._service_routes.pop(service_id, None)
+        self._service_plugins.pop(service_id, None)
+        self.services.pop(service_id, None)
+
+    def remove_route(self, route_id):
+        route = self.routes.pop(route_id, None)
+        if not route:
+            return
+
+        if self._route_names.get(route.get('name')) == route_id:
+            self._route_names.pop(route['name'])
+        self._service_routes[(route.get('service') or {}).get('id')].pop(route_id, None)
+        for tag in route.get('tags') or []:
+            self._tag_routes[tag].pop(route_id, None)
+        if route.get('tags') is None and '__' in (route.get('name') or ''):
+            self._realm_routes[route['name'].rsplit('__', 1)[-1]].pop(route_id, None)
+
+        # Kong removes the route plugins along with the route
+        for plugin_id in list(self._route_plugins.pop(route_id, {})):
+            self.plugins.pop(plugin_id, None)
+
+    def remove_plugin(self, plugin_id):
+        plugin = self.plugins.pop(plugin_id, None)
+        if not plugin:
+            return
+
+        if plugin.get('route'):
+            self._route_plugins[plugin['route']['id']].pop(plugin_id, None)
+        elif plugin.get('service'):
+            self._service_plugins[plugin['service']['id']].pop(plugin_id, None)
@@ -26,6 +26,7 @@ from helpers import (
     do_nothing,
     get_logger,
     load_json_file,
+    log_connection_stats,
     request,
 )
 from settings import (
@@ -101,6 +102,7 @@ if __name__ == "__main__":
         fn = COMMANDS[command]
         args = sys.argv[2:]
         fn(*args)
+        log_connection_stats(LOGGER)
     except Exception as e:
         LOGGER.error(str(e))
         sys.exit(1)
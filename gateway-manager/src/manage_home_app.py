@@ -18,20 +18,33 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import hmac
+import mimetypes
 import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
 
 from flask import (
     Flask,
+    Response,
+    g,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
+    send_from_directory,
 )
 
 from decode_token import get_userinfo
 from helpers import get_logger, load_json_file
+from kong_snapshot import KongSnapshot
 from manage_keycloak import get_realm_display_name
 from manage_kong import get_services_by_realm
+from metrics import REGISTRY, WorkerMetrics, get_cache_metrics
+from static_assets import StaticAssets, build_static
 from settings import (
     BASE_HOST,
     KONG_PUBLIC_REALM,
@@ -39,8 +52,20 @@ from settings import (
     REVISION,
     SERVICES_DATA_PATH,
     VERSION,
+    WEB_CACHE_TTL,
+    WEB_GRACEFUL_TIMEOUT,
+    WEB_KEYCLOAK_TIMEOUT,
+    WEB_KONG_TIMEOUT,
+    WEB_LOOKUP_WORKERS,
+    WEB_METRICS_INTERVAL,
+    WEB_METRICS_TOKEN,
+    WEB_REFRESH_INTERVAL,
+    WEB_SERVER_MODE,
     WEB_SERVER_PORT,
     WEB_SERVICE_NAME,
+    WEB_THREADS,
+    WEB_TIMEOUT,
+    WEB_WORKERS,
 )
 
 HOST = '0.0.0.0'
@@ -48,6 +73,9 @@ LOGGER = get_logger('HOME')
 app = None
 
 STATIC_URL = f'/{KONG_PUBLIC_REALM}/{WEB_SERVICE_NAME}/static'
+# the fingerprinted static files never change (one year)
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+ASSETS = StaticAssets()
 try:
     SERVICES = load_json_file(SERVICES_DATA_PATH, {
         'host': BASE_HOST,
@@ -56,57 +84,368 @@ try:
 except Exception:
     SERVICES = {}
 
+HOME_REQUESTS = REGISTRY.counter(
+    'gwm_home_requests_total',
+    'Home app requests by endpoint, method and response status.',
+    ['endpoint', 'method', 'status'],
+)
+HOME_DURATION = REGISTRY.histogram(
+    'gwm_home_request_duration_seconds',
+    'Duration of the home app requests by endpoint.',
+    ['endpoint'],
+)
+LOOKUP_DURATION = REGISTRY.histogram(
+    'gwm_home_lookup_duration_seconds',
+    'Duration of the landing page lookups by backend.',
+    ['backend'],
+)
+LOOKUP_ERRORS = REGISTRY.counter(
+    'gwm_home_lookup_errors_total',
+    'Failed landing page lookups by backend and reason (error or timeout).',
+    ['backend', 'status'],
+)
+
 
-def start_app():
+def _timed(fn, *args):
+    start = time.monotonic()
+    return fn(*args), time.monotonic() - start
+
+
+def _server_timing(timing):
+    # "Server-Timing" header value, timing: {name: (seconds, description)}
+    return ', '.join(
+        f'{name};dur={seconds * 1000:.1f}' + (f';desc="{desc}"' if desc else '')
+        for name, (seconds, desc) in timing.items()
+    )
+
+
+class LandingPageCache:
+    '''
+    Landing page data (realm display name and available services) by realm.
+
+    Only the first request of a realm waits for Keycloak and Kong, once the
+    entry is older than "ttl" seconds it is still served while a background
+    thread fetches it again. Besides, all the cached realms are refreshed every
+    "interval" seconds with a single Kong routes query.
+
+    The changes made by the other gateway-manager commands (separate processes)
+    are seen after "ttl" seconds, there is no other invalidation. The realm name
+    comes from the Keycloak realm cache (see RealmCache), so it can be up to
+    "ttl" + KEYCLOAK_REALM_TTL seconds old.
+
+    Both backends are queried at the same time, the ones that fail or do not
+    answer in time are replaced by the previous value or by a fallback (the
+    realm id as name, no services) and the entry is fetched again on the next
+    request. The lookups run in a pool of "lookups" threads, created on first
+    use so each worker process has its own one.
+    '''
+
+    def __init__(self, ttl=WEB_CACHE_TTL, interval=WEB_REFRESH_INTERVAL, lookups=WEB_LOOKUP_WORKERS):
+        self.ttl = ttl
+        self.interval = interval
+        self.lookups = lookups
+        self._lookups = None      # executor of the Kong and Keycloak lookups
+        self._lock = Lock()
+        self._items = {}          # realm -> (fetched at, data)
+        self._refreshing = set()  # realms being fetched in background
+        self._fetch_locks = {}    # realm -> lock (first fetch)
+        self._refresher = None
+        self._snapshot = None     # Kong routes and services of the last refresh
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0}
+
+    def _submit(self, fn, *args):
+        # the slow lookups keep running after their timeout
+        with self._lock:
+            if not self._lookups:
+                self._lookups = ThreadPoolExecutor(max_workers=self.lookups, thread_name_prefix='lookup')
+        return self._lookups.submit(_timed, fn, *args)
+
+    def _fetch(self, realm, snapshot=None, previous=None):
+        # returns the data, the backends timing and if any of them failed
+        previous = previous or {'realm_name': realm, 'available_services': []}
+        start = time.monotonic()
+        futures = {
+            # backend: (future, timeout, data key)
+            'kong': (
+                self._submit(snapshot.get_services_by_realm if snapshot else get_services_by_realm, realm),
+                WEB_KONG_TIMEOUT,
+                'available_services',
+            ),
+            'keycloak': (
+                self._submit(get_realm_display_name, realm),
+                WEB_KEYCLOAK_TIMEOUT,
+                'realm_name',
+            ),
+        }
+
+        data = {}
+        timing = {}
+        partial = False
+        for backend, (future, timeout, key) in futures.items():
+            try:
+                # the timeouts count from the start, the lookups run concurrently
+                data[key], seconds = future.result(timeout=max(0, start + timeout - time.monotonic()))
+                timing[backend] = (seconds, None)
+            except Exception as e:
+                status = 'error' if future.done() else 'timeout'
+                LOGGER.warning(f'Realm "{realm}": {backend} lookup {status}' + (f' ({e})' if future.done() else ''))
+                data[key] = previous[key]
+                timing[backend] = (time.monotonic() - start, status)
+                LOOKUP_ERRORS.inc(backend=backend, status=status)
+                partial = True
+                with self._lock:
+                    self.stats['errors'] += 1
+
+        for backend, (seconds, _) in timing.items():
+            LOOKUP_DURATION.observe(seconds, backend=backend)
+
+        data['services'] = [
+            value
+            for key, value in SERVICES.items()
+            if key in data['available_services']
+        ]
+        return data, timing, partial
+
+    def _store(self, realm, data, expired=False):
+        with self._lock:
+            self._refreshing.discard(realm)
+            self._items[realm] = (time.monotonic() - (self.ttl if expired else 0), data)
+        return data
+
+    def _refresh(self, realm, snapshot=None):
+        item = self._items.get(realm)
+        data, _, partial = self._fetch(realm, snapshot, item[1] if item else None)
+        # with previous data the failed lookups are tried again after "ttl" seconds,
+        # the fallback values are replaced as soon as possible
+        self._store(realm, data, expired=partial and not item)
+
+    def _load_routes(self):
+        # the services are read again only if the routes point to new ones
+        snapshot = self._snapshot or KongSnapshot()
+        snapshot.load_routes()
+        service_ids = {(route.get('service') or {}).get('id') for route in snapshot.routes.values()}
+        if not self._snapshot or service_ids - {None} - set(snapshot.services):
+            snapshot.load_services()
+        self._snapshot = snapshot
+        return snapshot
+
+    def _refresh_all(self):
+        while True:
+            time.sleep(self.interval)
+            realms = list(self._items)
+            if not realms:
+                continue
+
+            try:
+                snapshot = self._load_routes()
+            except Exception as e:
+                LOGGER.warning(f'Could not load Kong routes: {e}')
+                continue
+            for realm in realms:
+                self._refresh(realm, snapshot)
+            LOGGER.debug(f'Refreshed {len(realms)} realms')
+
+    def start(self):
+        if self.interval > 0 and not self._refresher:
+            self._refresher = Thread(target=self._refresh_all, daemon=True)
+            self._refresher.start()
+
+    def get(self, realm):
+        # returns the data and the backends timing
+        start = time.monotonic()
+        with self._lock:
+            item = self._items.get(realm)
+            if item:
+                self.stats['hits'] += 1
+                if time.monotonic() - item[0] > self.ttl and realm not in self._refreshing:
+                    self._refreshing.add(realm)
+                    self.stats['refreshes'] += 1
+                    Thread(target=self._refresh, args=(realm,), daemon=True).start()
+                return item[1], {'cache': (time.monotonic() - start, 'hit')}
+
+            self.stats['misses'] += 1
+            fetch_lock = self._fetch_locks.setdefault(realm, Lock())
+
+        # the concurrent requests of a new realm wait for the first one
+        with fetch_lock:
+            item = self._items.get(realm)
+            if item:
+                return item[1], {'cache': (time.monotonic() - start, 'hit')}
+
+            data, timing, partial = self._fetch(realm)
+            self._store(realm, data, expired=partial)
+            return data, {'cache': (time.monotonic() - start, 'miss'), **timing}
+
+
+CACHE = LandingPageCache()
+# metrics of all the workers (production mode)
+METRICS = WorkerMetrics(REGISTRY, WEB_METRICS_INTERVAL)
+
+
+@REGISTRY.collector
+def _get_home_metrics():
+    return [
+        *get_cache_metrics({'landing_pages': CACHE.stats}),
+        (
+            'gwm_home_cache_refreshes_total', 'counter', 'Background refreshes of the landing page cache.',
+            [({}, CACHE.stats['refreshes'])],
+        ),
+        (
+            'gwm_home_cached_realms', 'gauge', 'Realms in the landing page cache.',
+            [({}, len(CACHE._items))],
+        ),
+    ]
+
+
+def create_app():
+    ASSETS.build()
     app = Flask(
         '__main__',
         template_folder='../templates',
-        static_folder='../static',
-        static_url_path=STATIC_URL,
+        static_folder=None,  # see "_static"
     )
 
+    @app.template_global()
+    def static(name):
+        # fingerprinted url of the static file
+        return f'{BASE_HOST}{STATIC_URL}/{ASSETS.get_path(name)}'
+
+    @app.template_filter()
+    def fingerprint(url):
+        # fingerprinted url of the static urls, like the service icons
+        prefix = f'{STATIC_URL}/'
+        if url and url.startswith(prefix):
+            return prefix + ASSETS.get_path(url[len(prefix):])
+        return url
+
+    @app.before_request
+    def _start_timer():
+        g.start = time.monotonic()
+
+    @app.after_request
+    def _observe_request(response):
+        endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+        HOME_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        HOME_DURATION.observe_since(g.start, endpoint=endpoint)
+        return response
+
     @app.route(f'/{KONG_PUBLIC_REALM}/{WEB_SERVICE_NAME}/health', methods=['GET'])
     def _health():
         # health endpoint, returns current commit hash and version
         return jsonify(version=VERSION, revision=REVISION)
 
+    @app.route(f'/{KONG_PUBLIC_REALM}/{WEB_SERVICE_NAME}/metrics', methods=['GET'])
+    def _metrics():
+        # metrics endpoint (Prometheus text format), only with the bearer token
+        if not WEB_METRICS_TOKEN:
+            return make_response('Not Found', 404)
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {WEB_METRICS_TOKEN}'):
+            return make_response('Unauthorized', 401, {'WWW-Authenticate': 'Bearer'})
+        return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route(f'{STATIC_URL}/<path:filename>', methods=['GET'])
+    def _static(filename):
+        asset = ASSETS.get_asset(filename)
+        if not asset:
+            # original names, revalidated with ETag/Last-Modified
+            return send_from_directory(ASSETS.source_path, filename, conditional=True)
+
+        gzipped = asset['gzip'] and 'gzip' in request.accept_encodings
+        response = send_from_directory(
+            ASSETS.build_path,
+            f'{filename}.gz' if gzipped else filename,
+            mimetype=mimetypes.guess_type(asset['name'])[0],
+            conditional=True,
+            etag=f'{asset["hash"]}-gzip' if gzipped else asset['hash'],
+            max_age=STATIC_MAX_AGE,
+        )
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+        response.vary.add('Accept-Encoding')
+        return response
+
     @app.route('/<realm>/', methods=['GET'])
     def _index(realm):
         # landing page
-        realm_name = get_realm_display_name(realm)
-        available_services = get_services_by_realm(realm)
-        services = [
-            value
-            for key, value in SERVICES.items()
-            if key in available_services
-        ]
+        data, timing = CACHE.get(realm)
+        username, seconds = _timed(get_userinfo, request.headers.get(KONG_TOKEN_HEADER))
+        timing['userinfo'] = (seconds, None)
 
-        username = get_userinfo(request.headers.get(KONG_TOKEN_HEADER))
-        return render_template(
+        start = time.monotonic()
+        response = make_response(render_template(
             'landing-page.html',
             # realm urls
             account_url=f'{BASE_HOST}/realms/{realm}/account',
             base_url=f'{BASE_HOST}/{realm}',
             logout_url=f'{BASE_HOST}/{realm}/{WEB_SERVICE_NAME}/logout',
-            static_url=f'{BASE_HOST}{STATIC_URL}',
             # realm & user info
-            tenant=realm_name,
+            tenant=data['realm_name'],
             username=username,
-            services=services,
-        )
+            services=data['services'],
+        ))
+        timing['render'] = (time.monotonic() - start, None)
+        response.headers['Server-Timing'] = _server_timing(timing)
+        return response
 
     @app.route(f'/<realm>/{WEB_SERVICE_NAME}/', methods=['GET'])
     def _index_2(realm):
         # this is the url used after logout, redirect to /<realm>
         return redirect(f'/{realm}')
 
-    app.run(host=HOST, port=WEB_SERVER_PORT)
-    LOGGER.info(f'App started on {HOST}:{WEB_SERVER_PORT}')
+    return app
+
+
+def serve_app(app):
+    # preforking server, the workers are restarted gracefully with "kill -HUP <master pid>"
+    from gunicorn.app.base import BaseApplication
+
+    class HomeApplication(BaseApplication):
+
+        def load_config(self):
+            for key, value in {
+                'bind': f'{HOST}:{WEB_SERVER_PORT}',
+                'workers': WEB_WORKERS,
+                'threads': WEB_THREADS,
+                'worker_class': 'gthread',
+                'timeout': WEB_TIMEOUT,
+                'graceful_timeout': WEB_GRACEFUL_TIMEOUT,
+                # the threads do not survive the fork, each worker has its own cache
+                'post_fork': lambda server, worker: (CACHE.start(), METRICS.start()),
+                'worker_exit': lambda server, worker: METRICS.write(),
+                'child_exit': lambda server, worker: METRICS.remove_worker(worker.pid),
+                'on_exit': lambda server: METRICS.clear(),
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    if WEB_METRICS_TOKEN:
+        # the workers share their metrics through files
+        METRICS.setup()
+
+    LOGGER.info(
+        f'App starting on {HOST}:{WEB_SERVER_PORT}'
+        f' ({WEB_WORKERS} workers x {WEB_THREADS} threads)'
+    )
+    HomeApplication().run()
+
+
+def start_app():
+    app = create_app()
+    if WEB_SERVER_MODE == 'development':
+        CACHE.start()
+        app.run(host=HOST, port=WEB_SERVER_PORT)
+        LOGGER.info(f'App started on {HOST}:{WEB_SERVER_PORT}')
+    else:
+        serve_app(app)
 
 
 if __name__ == '__main__':
     COMMANDS = {
         'START_APP': start_app,
+        'BUILD_STATIC': build_static,
     }
 
     command = sys.argv[1]
@@ -18,12 +18,21 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import asyncio
+import csv
+import json
+import re
 import sys
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from threading import Lock, Thread, local
 from typing import Callable, Dict
+from weakref import WeakKeyDictionary, WeakSet
 
-from keycloak import KeycloakAdmin
-from keycloak.exceptions import KeycloakError
+from keycloak import KeycloakAdmin, KeycloakOpenIDConnection
+from keycloak.exceptions import KeycloakError, KeycloakGetError
 
 from helpers import (
     categorize_arguments,
@@ -32,6 +41,7 @@ from helpers import (
     get_logger,
     load_json_file,
 )
+from metrics import REGISTRY, get_cache_metrics, observe_request
 
 from settings import (
     BASE_HOST,
@@ -39,12 +49,449 @@ from settings import (
     KC_ADMIN_USER,
     KC_ADMIN_PASSWORD,
     KC_ADMIN_REALM,
+    KC_CACHE_RETRIES,
+    KC_CONCURRENCY,
+    KC_LOOKUP_TTL,
+    KC_REALM_TTL,
+    KC_SECRET_TTL,
     KONG_PUBLIC_REALM,
     TEMPLATES,
 )
 
 LOGGER = get_logger('Keycloak')
 
+# sometimes the admin calls fail with an authentication error, this is due to
+# some Keycloak internal caching, clearing the realm cache fixes it
+STALE_CACHE_STATUSES = (401, 403)
+ADMIN_REALM_PATH = re.compile(r'admin/realms/([^/?]+)')
+
+# number of users sent in each partial import call
+USERS_BATCH_SIZE = 500
+# user file columns (CSV), the rest of the user representation fields are allowed in JSONL files
+USERS_CSV_FIELDS = ['username', 'email', 'firstName', 'lastName', 'enabled']
+USERS_CSV_GROUPS_SEPARATOR = ';'
+
+
+############################################
+#
+# Keycloak Admin connections
+#
+############################################
+
+class KeycloakConnection(KeycloakOpenIDConnection):
+    '''
+    Admin connection that reports its logins and token refreshes to the pool.
+
+    The calls that still fail with an authentication error after the token
+    refresh are retried (at most KC_CACHE_RETRIES times) after clearing the
+    cache of the realm in the call path.
+    '''
+
+    def __init__(self, pool, **kwargs):
+        self.pool = pool
+        super().__init__(**kwargs)
+
+    def get_token(self):
+        start = time.monotonic()
+        super().get_token()
+        self.pool.record('logins', start)
+
+    def refresh_token(self):
+        if not (self.token or {}).get('refresh_token'):
+            return super().refresh_token()  # first login
+
+        start = time.monotonic()
+        super().refresh_token()
+        self.pool.record('refreshes', start)
+
+    def _observed(self, raw_fn, path, *args, **kwargs):
+        start = time.monotonic()
+        status = 'error'
+        try:
+            response = raw_fn(path, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            observe_request(self.server_url, raw_fn.__name__.rsplit('_', 1)[-1], status, start)
+
+    async def _a_observed(self, raw_fn, path, *args, **kwargs):
+        start = time.monotonic()
+        status = 'error'
+        try:
+            response = await raw_fn(path, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            observe_request(self.server_url, raw_fn.__name__.rsplit('_', 1)[-1], status, start)
+
+    def _retry_on_stale_cache(self, raw_fn, path, *args, **kwargs):
+        response = self._observed(raw_fn, path, *args, **kwargs)
+        match = ADMIN_REALM_PATH.search(path)
+        retries = 0
+        while match and response.status_code in STALE_CACHE_STATUSES and retries < KC_CACHE_RETRIES:
+            realm = match.group(1)
+            LOGGER.warning(f'Authentication failed on realm "{realm}", clearing its cache...')
+            super().raw_post(f'admin/realms/{realm}/clear-realm-cache', data='')
+            self.pool.record('cache_clears')
+
+            retries += 1
+            response = self._observed(raw_fn, path, *args, **kwargs)
+        return response
+
+    def raw_get(self, path, **kwargs):
+        return self._retry_on_stale_cache(super().raw_get, path, **kwargs)
+
+    def raw_post(self, path, data, **kwargs):
+        return self._retry_on_stale_cache(super().raw_post, path, data, **kwargs)
+
+    def raw_put(self, path, data, **kwargs):
+        return self._retry_on_stale_cache(super().raw_put, path, data, **kwargs)
+
+    def raw_delete(self, path, data=None, **kwargs):
+        return self._retry_on_stale_cache(super().raw_delete, path, data, **kwargs)
+
+    # async counterparts
+
+    async def a_get_token(self):
+        start = time.monotonic()
+        await super().a_get_token()
+        self.pool.record('logins', start)
+
+    async def a_refresh_token(self):
+        if not (self.token or {}).get('refresh_token'):
+            return await super().a_refresh_token()  # first login
+
+        start = time.monotonic()
+        await super().a_refresh_token()
+        self.pool.record('refreshes', start)
+
+    async def _a_retry_on_stale_cache(self, raw_fn, path, *args, **kwargs):
+        response = await self._a_observed(raw_fn, path, *args, **kwargs)
+        match = ADMIN_REALM_PATH.search(path)
+        retries = 0
+        while match and response.status_code in STALE_CACHE_STATUSES and retries < KC_CACHE_RETRIES:
+            realm = match.group(1)
+            LOGGER.warning(f'Authentication failed on realm "{realm}", clearing its cache...')
+            await super().a_raw_post(f'admin/realms/{realm}/clear-realm-cache', data='')
+            self.pool.record('cache_clears')
+
+            retries += 1
+            response = await self._a_observed(raw_fn, path, *args, **kwargs)
+        return response
+
+    async def a_raw_get(self, path, **kwargs):
+        return await self._a_retry_on_stale_cache(super().a_raw_get, path, **kwargs)
+
+    async def a_raw_post(self, path, data, **kwargs):
+        return await self._a_retry_on_stale_cache(super().a_raw_post, path, data, **kwargs)
+
+    async def a_raw_put(self, path, data, **kwargs):
+        return await self._a_retry_on_stale_cache(super().a_raw_put, path, data, **kwargs)
+
+    async def a_raw_delete(self, path, data=None, **kwargs):
+        return await self._a_retry_on_stale_cache(super().a_raw_delete, path, data, **kwargs)
+
+
+class KeycloakAdminPool:
+    '''
+    Authenticated admin clients, shared by all the helpers in the process.
+
+    There is one client per thread because the current realm is part of the
+    client state, it lives in a thread local so it is released when the thread
+    ends (the stale cache refreshes run in short lived threads). Only the first
+    client logs in, the others start with a copy
+    of its token and refresh it when it expires, changing the realm is a local
+    operation (the admin user always authenticates against the master realm).
+
+    The async clients are bound to the event loop of their HTTP connections,
+    there is one per event loop and realm so the concurrent coroutines never
+    change the realm of another one.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._local = local()                       # .client -> client of the thread
+        self._clients = WeakSet()                   # clients of the live threads
+        self._async_clients = WeakKeyDictionary()   # event loop -> realm -> client
+        # only one login at a time, the rest wait for its token
+        self._login_lock = Lock()
+        self._async_login_locks = WeakKeyDictionary()  # event loop -> lock
+        self.stats = {'logins': 0, 'logins_time': 0.0, 'refreshes': 0, 'refreshes_time': 0.0, 'cache_clears': 0}
+
+    def record(self, action, start=None):
+        with self._lock:
+            self.stats[action] += 1
+            if start is not None:
+                self.stats[f'{action}_time'] += time.monotonic() - start
+
+    def _all_clients(self):
+        return [
+            *self._clients,
+            *[c for clients in self._async_clients.values() for c in clients.values()],
+        ]
+
+    def _new_client(self, realm):
+        # starts with the token of any other client (if any)
+        with self._lock:
+            token = next((c.connection.token for c in self._all_clients() if c.connection.token), None)
+
+        connection = KeycloakConnection(
+            pool=self,
+            server_url=KC_ADMIN_URL,
+            username=KC_ADMIN_USER,
+            password=KC_ADMIN_PASSWORD,
+            realm_name=realm,
+            user_realm_name=KC_ADMIN_REALM,
+            token=dict(token) if token else None,
+        )
+        return KeycloakAdmin(connection=connection)
+
+    def get(self, realm=KC_ADMIN_REALM):
+        holder = self._local
+        keycloak_admin = getattr(holder, 'client', None)
+
+        if not keycloak_admin:
+            with self._login_lock:
+                keycloak_admin = self._new_client(realm)
+                if not keycloak_admin.connection.token:
+                    keycloak_admin.connection.get_token()
+            holder.client = keycloak_admin
+            with self._lock:
+                self._clients.add(keycloak_admin)
+
+        keycloak_admin.change_current_realm(realm)
+        return keycloak_admin
+
+    async def a_get(self, realm=KC_ADMIN_REALM):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            keycloak_admin = self._async_clients.get(loop, {}).get(realm)
+            login_lock = self._async_login_locks.setdefault(loop, asyncio.Lock())
+
+        if not keycloak_admin:
+            async with login_lock:
+                keycloak_admin = self._async_clients.get(loop, {}).get(realm)
+                if not keycloak_admin:
+                    keycloak_admin = self._new_client(realm)
+                    if not keycloak_admin.connection.token:
+                        await keycloak_admin.connection.a_get_token()
+                    with self._lock:
+                        self._async_clients.setdefault(loop, {})[realm] = keycloak_admin
+
+        return keycloak_admin
+
+    def clear(self):
+        with self._lock:
+            # a new holder drops the clients of every thread
+            self._local = local()
+            self._clients = WeakSet()
+            self._async_clients.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'clients': len(self._all_clients())}
+
+
+ADMIN_POOL = KeycloakAdminPool()
+
+
+class KeycloakIndex:
+    '''
+    Realm entities (clients, groups, roles) by name, kept at most "ttl" seconds.
+
+    The entries are removed by the actions that change them.
+    '''
+
+    def __init__(self, ttl=KC_LOOKUP_TTL):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._items = {}  # (realm, kind, name) -> (expires at, value)
+        self._loading = {}  # (event loop, realm, kind, name) -> task (async lookups)
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def _get_cached(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item and item[0] > time.monotonic():
+                self.stats['hits'] += 1
+                return True, item[1]
+        return False, None
+
+    def _set_cached(self, key, value):
+        with self._lock:
+            self.stats['misses'] += 1
+            if value is not None:  # not found entities could be created later
+                self._items[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def get(self, realm, kind, name, loader):
+        key = (realm, kind, name)
+        found, value = self._get_cached(key)
+        return value if found else self._set_cached(key, loader())
+
+    async def _a_load(self, key, loader):
+        try:
+            return self._set_cached(key, await loader())
+        finally:
+            with self._lock:
+                self._loading.pop((asyncio.get_running_loop(), *key), None)
+
+    async def a_get(self, realm, kind, name, loader):
+        # "loader" returns an awaitable, the concurrent calls wait for the same load
+        key = (realm, kind, name)
+        found, value = self._get_cached(key)
+        if found:
+            return value
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._loading.get((loop, *key))
+            if task:
+                self.stats['hits'] += 1
+            else:
+                task = self._loading[(loop, *key)] = loop.create_task(self._a_load(key, loader))
+        # the load goes on if one of the callers is cancelled
+        return await asyncio.shield(task)
+
+    def invalidate(self, realm, kind=None, name=None):
+        with self._lock:
+            for key in list(self._items):
+                if realm in (None, key[0]) and kind in (None, key[1]) and name in (None, key[2]):
+                    self._items.pop(key)
+
+
+INDEX = KeycloakIndex()
+# client secrets, only in memory
+SECRETS = KeycloakIndex(KC_SECRET_TTL)
+
+
+class RealmCache:
+    '''
+    Realm representations by name, used by the landing pages.
+
+    Only the first request of a realm waits for Keycloak, once the entry is
+    older than "ttl" seconds it is still returned while a background thread
+    fetches it again (one at a time per realm).
+    '''
+
+    def __init__(self, ttl=KC_REALM_TTL):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._items = {}          # realm -> (fetched at, representation)
+        self._refreshing = set()  # realms being fetched in background
+        self._fetch_locks = {}    # realm -> lock (first fetch)
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0}
+
+    def _fetch(self, realm):
+        try:
+            return get_client(exit_on_error=False).get_realm(realm)
+        except Exception as e:
+            LOGGER.warning(f'Could not get realm "{realm}" from Keycloak: {e}')
+            return None
+
+    async def _a_fetch(self, realm):
+        try:
+            keycloak_admin = await ADMIN_POOL.a_get(KC_ADMIN_REALM)
+            return await keycloak_admin.a_get_realm(realm)
+        except Exception as e:
+            LOGGER.warning(f'Could not get realm "{realm}" from Keycloak: {e}')
+            return None
+
+    def _store(self, realm, representation):
+        with self._lock:
+            self._refreshing.discard(realm)
+            if representation is None:
+                # keep the previous value (if any) and try again after "ttl" seconds
+                self.stats['errors'] += 1
+                representation = self._items.get(realm, (None, {}))[1]
+            self._items[realm] = (time.monotonic(), representation)
+        return representation
+
+    def _refresh(self, realm):
+        self._store(realm, self._fetch(realm))
+
+    def _get_cached(self, realm):
+        with self._lock:
+            item = self._items.get(realm)
+            if not item:
+                self.stats['misses'] += 1
+                return None
+
+            self.stats['hits'] += 1
+            if time.monotonic() - item[0] > self.ttl and realm not in self._refreshing:
+                self._refreshing.add(realm)
+                self.stats['refreshes'] += 1
+                Thread(target=self._refresh, args=(realm,), daemon=True).start()
+            return item[1]
+
+    def get(self, realm):
+        representation = self._get_cached(realm)
+        if representation is None:
+            # the concurrent requests of a new realm wait for the first one
+            with self._lock:
+                fetch_lock = self._fetch_locks.setdefault(realm, Lock())
+            with fetch_lock:
+                item = self._items.get(realm)
+                representation = item[1] if item else self._store(realm, self._fetch(realm))
+        return representation
+
+    async def a_get(self, realm):
+        representation = self._get_cached(realm)
+        if representation is None:
+            representation = self._store(realm, await self._a_fetch(realm))
+        return representation
+
+    def invalidate(self, realm=None):
+        # only the cache of this process, the landing pages (another process)
+        # see the changes once their entries are older than "ttl" seconds
+        with self._lock:
+            if realm is None:
+                self._items.clear()
+            else:
+                self._items.pop(realm, None)
+
+
+REALMS = RealmCache()
+
+
+@REGISTRY.collector
+def _get_keycloak_metrics():
+    stats = ADMIN_POOL.get_stats()
+    return [
+        *get_cache_metrics({
+            'keycloak_lookups': INDEX.stats,
+            'keycloak_secrets': SECRETS.stats,
+            'keycloak_realms': REALMS.stats,
+        }),
+        (
+            'gwm_keycloak_token_requests_total', 'counter', 'Keycloak admin logins and token refreshes.',
+            [({'action': 'login'}, stats['logins']), ({'action': 'refresh'}, stats['refreshes'])],
+        ),
+        (
+            'gwm_keycloak_token_duration_seconds_total', 'counter',
+            'Time spent in Keycloak admin logins and token refreshes.',
+            [({'action': 'login'}, stats['logins_time']), ({'action': 'refresh'}, stats['refreshes_time'])],
+        ),
+        (
+            'gwm_keycloak_cache_clears_total', 'counter', 'Keycloak realm cache clears after authentication errors.',
+            [({}, stats['cache_clears'])],
+        ),
+    ]
+
+
+def log_admin_stats(logger):
+    stats = ADMIN_POOL.get_stats()
+    if not stats['clients']:
+        return
+    logger.debug(
+        f'Keycloak: {stats["clients"]} admin clients,'
+        f' {stats["logins"]} logins ({stats["logins_time"]:.3f}s),'
+        f' {stats["refreshes"]} token refreshes ({stats["refreshes_time"]:.3f}s),'
+        f' {stats["cache_clears"]} realm cache clears,'
+        f' {INDEX.stats["hits"]} lookup hits, {INDEX.stats["misses"]} lookup misses,'
+        f' {SECRETS.stats["hits"]} secret hits, {SECRETS.stats["misses"]} secret misses'
+    )
+
 
 ############################################
 #
@@ -55,12 +502,7 @@ LOGGER = get_logger('Keycloak')
 def get_client(exit_on_error=True):
     try:
         # connect to master realm
-        keycloak_admin = KeycloakAdmin(server_url=KC_ADMIN_URL,
-                                       username=KC_ADMIN_USER,
-                                       password=KC_ADMIN_PASSWORD,
-                                       realm_name=KC_ADMIN_REALM,
-                                       )
-        return keycloak_admin
+        return ADMIN_POOL.get(KC_ADMIN_REALM)
 
     except KeycloakError as ke:
         LOGGER.critical('Keycloak is NOT ready!')
@@ -72,10 +514,8 @@ def get_client(exit_on_error=True):
 
 def client_for_realm(realm, exit_on_error=True):
     try:
+        # the realm cache is cleared only if the calls fail (see KeycloakConnection)
         keycloak_admin = get_client(exit_on_error)
-        # sometimes authentication fails, this is due to some internal caching
-        # clear the internal caching first
-        keycloak_admin.clear_realm_cache()
         keycloak_admin.change_current_realm(realm)
         # keycloak_admin.users_count()  # check that realm exists
         return keycloak_admin
@@ -88,12 +528,38 @@ def client_for_realm(realm, exit_on_error=True):
         raise e
 
 
+def get_client_pk(realm, client_id):
+    # searched by "clientId" in the server
+    return INDEX.get(realm, 'client', client_id, lambda: client_for_realm(realm).get_client_id(client_id))
+
+
+def get_group_id(realm, group):
+    # top level group name or group path
+    path = group if group.startswith('/') else f'/{group}'
+
+    def _loader():
+        try:
+            return client_for_realm(realm).get_group_by_path(path)['id']
+        except KeycloakGetError:
+            return None
+
+    return INDEX.get(realm, 'group', path, _loader)
+
+
+def _load_client_secret(realm, client_id):
+    keycloak_admin = client_for_realm(realm)
+    client_pk = get_client_pk(realm, client_id)
+    secrets = keycloak_admin.get_client_secrets(client_pk)
+    return secrets.get('value')
+
+
+def invalidate_client_secret(realm=None, client_id=None):
+    SECRETS.invalidate(realm, 'secret', client_id)
+
+
 def get_client_secret(realm, client_id):
     try:
-        keycloak_admin = client_for_realm(realm)
-        client_pk = keycloak_admin.get_client_id(client_id)
-        secrets = keycloak_admin.get_client_secrets(client_pk)
-        return secrets.get('value')
+        return SECRETS.get(realm, 'secret', client_id, lambda: _load_client_secret(realm, client_id))
 
     except KeycloakError as ke:
         LOGGER.error('Could not get info from Keycloak')
@@ -110,17 +576,13 @@ def is_keycloak_ready():
     LOGGER.success('Keycloak is ready!')
 
 
+def _get_display_name(realm, representation):
+    return representation.get('displayNameHtml') or representation.get('displayName') or realm
+
+
 def get_realm_display_name(realm):
-    try:
-        keycloak_admin = client_for_realm(realm, exit_on_error=False)
-        # get all realms and search for current one
-        realms = keycloak_admin.get_realms()
-        for r in realms:
-            if r['realm'] == realm:
-                return r.get('displayNameHtml') or r.get('displayName') or realm
-        return realm
-    except Exception:
-        return realm
+    # cached, see RealmCache
+    return _get_display_name(realm, REALMS.get(realm))
 
 
 def get_user(realm, username):
@@ -137,19 +599,18 @@ def get_realm_roles(realm):
 
 def get_clients(realm, name=None):
     keycloak_admin = client_for_realm(realm)
-    clients = keycloak_admin.get_clients()
     if not name:
-        return clients
-    try:
-        return [i for i in clients if i.get('clientId') == name][0]
-    except IndexError:
-        return None
+        return keycloak_admin.get_clients()
+
+    client_pk = get_client_pk(realm, name)
+    return keycloak_admin.get_client(client_pk) if client_pk else None
 
 
 def get_client_roles(realm, client_id):
-    keycloak_admin = client_for_realm(realm)
-    client_roles = keycloak_admin.get_client_roles(client_id=client_id)
-    return client_roles
+    return INDEX.get(
+        realm, 'client_roles', client_id,
+        lambda: client_for_realm(realm).get_client_roles(client_id=client_id),
+    )
 
 
 def assign_all_client_roles(realm, username, client_name):
@@ -174,15 +635,91 @@ def assign_all_client_roles(realm, username, client_name):
 
 ############################################
 #
-# Keycloak Actions
+# Keycloak Admin async helpers
 #
 ############################################
 
+# Same as the helpers above but they raise the errors instead of exiting,
+# the callers are long running processes (home app, async Kong provisioning).
 
-def create_realm(realm, *args, kwargs={}):
+async def a_client_for_realm(realm):
+    return await ADMIN_POOL.a_get(realm)
+
+
+async def a_get_client_pk(realm, client_id):
+    keycloak_admin = await a_client_for_realm(realm)
+    return await INDEX.a_get(realm, 'client', client_id, lambda: keycloak_admin.a_get_client_id(client_id))
+
+
+async def _a_load_client_secret(realm, client_id):
+    keycloak_admin = await a_client_for_realm(realm)
+    client_pk = await a_get_client_pk(realm, client_id)
+    secrets = await keycloak_admin.a_get_client_secrets(client_pk)
+    return secrets.get('value')
+
+
+async def a_get_client_secret(realm, client_id):
+    return await SECRETS.a_get(realm, 'secret', client_id, lambda: _a_load_client_secret(realm, client_id))
+
+
+async def a_get_realm_display_name(realm):
+    return _get_display_name(realm, await REALMS.a_get(realm))
+
+
+async def a_get_user(realm, username):
+    keycloak_admin = await a_client_for_realm(realm)
+    user_id = await keycloak_admin.a_get_user_id(username)
+    return await keycloak_admin.a_get_user(user_id)
+
+
+async def a_get_clients(realm, name=None):
+    keycloak_admin = await a_client_for_realm(realm)
+    if not name:
+        return await keycloak_admin.a_get_clients()
+
+    client_pk = await a_get_client_pk(realm, name)
+    return await keycloak_admin.a_get_client(client_pk) if client_pk else None
+
+
+async def a_get_client_roles(realm, client_id):
+    keycloak_admin = await a_client_for_realm(realm)
+    return await INDEX.a_get(
+        realm, 'client_roles', client_id,
+        lambda: keycloak_admin.a_get_client_roles(client_id=client_id),
+    )
+
+
+async def a_assign_all_client_roles(realm, username, client_name):
     check_realm(realm)
 
-    config = load_json_file(TEMPLATES['realm'], {
+    keycloak_admin = await a_client_for_realm(realm)
+    user, client = await asyncio.gather(
+        a_get_user(realm, username),
+        a_get_clients(realm, client_name),
+    )
+    client_roles = await a_get_client_roles(realm, client.get('id'))
+    roles = [
+        {'id': role.get('id'), 'name': role.get('name')}
+        for role in client_roles
+    ]
+    await keycloak_admin.a_assign_client_role(
+        client_id=client.get('id'),
+        user_id=user.get('id'),
+        roles=roles,
+    )
+    LOGGER.success(f'Added all rights to client "{client_name}"'
+                   f' to "{username}" on realm "{realm}"')
+
+
+############################################
+#
+# Keycloak Actions
+#
+############################################
+
+
+def _get_realm_config(realm, kwargs={}):
+    return load_json_file(TEMPLATES['realm'], {
         'realm': realm,
         'displayName': kwargs.get('description', realm),
         'accountTheme': kwargs.get('account_theme', 'keycloak'),
@@ -193,6 +730,11 @@ def create_realm(realm, *args, kwargs={}):
         'publicRealm': KONG_PUBLIC_REALM,
     })
 
+
+def create_realm(realm, *args, kwargs={}):
+    check_realm(realm)
+
+    config = _get_realm_config(realm, kwargs)
     if kwargs.get('test'):
         LOGGER.debug(config)
         return
@@ -201,6 +743,8 @@ def create_realm(realm, *args, kwargs={}):
     keycloak_admin = get_client()
 
     _status = keycloak_admin.create_realm(config, skip_exists=True)
+    INDEX.invalidate(realm)
+    REALMS.invalidate(realm)
     if _status:
         LOGGER.warning(f'- {str(_status)}')
     LOGGER.success(f'Added realm "{realm}"')
@@ -260,17 +804,247 @@ def add_user_group(realm, username, group, *args, kwargs={}):
     LOGGER.info(f'Adding user "{username}" to group "{group}" on realm "{realm}"...')
     keycloak_admin = client_for_realm(realm)
     user_id = keycloak_admin.get_user_id(username=username)
-    groups = keycloak_admin.get_groups()  # get all groups
-    was_added = False
-    for g in groups:
-        if g['name'] == group:  # identify group by name
-            keycloak_admin.group_user_add(user_id=user_id, group_id=g['id'])
-            LOGGER.success(f'Added user "{username}" to group "{group}" on realm "{realm}"')
-            was_added = True
-    if not was_added:
+    group_id = get_group_id(realm, group)
+    if group_id:
+        keycloak_admin.group_user_add(user_id=user_id, group_id=group_id)
+        LOGGER.success(f'Added user "{username}" to group "{group}" on realm "{realm}"')
+    else:
         LOGGER.warning(f'Could not add user "{username}" to group "{group}" on realm "{realm}"')
 
 
+def _is_true(value):
+    return str(value).strip().lower() in ('true', 'yes', '1')
+
+
+def _read_users(file_path, file_format=None):
+    # yields (line number, user) one at a time, the file is never fully loaded in memory
+    file_format = file_format or ('csv' if file_path.lower().endswith('.csv') else 'jsonl')
+    with open(file_path, newline='') as _f:
+        if file_format == 'csv':
+            reader = csv.DictReader(_f)
+            for row in reader:
+                user = {k: v for k, v in row.items() if k in USERS_CSV_FIELDS and v}
+                user['password'] = row.get('password')
+                user['temporary_password'] = row.get('temporary_password')
+                user['groups'] = [
+                    g.strip()
+                    for g in (row.get('groups') or '').split(USERS_CSV_GROUPS_SEPARATOR)
+                    if g.strip()
+                ]
+                yield reader.line_num, user
+        else:
+            for line_number, line in enumerate(_f, 1):
+                if line.strip():
+                    try:
+                        yield line_number, json.loads(line)
+                    except ValueError:
+                        yield line_number, None
+
+
+def _get_user_error(user, has_group=None):
+    # why the user would make the whole partial import fail, None if valid
+    if not isinstance(user, dict):
+        return 'not a valid user'
+    if not str(user.get('username') or '').strip():
+        return 'missing "username"'
+    groups = user.get('groups') or []
+    if not isinstance(groups, list):
+        return '"groups" is not a list'
+    missing = [group for group in groups if has_group and not has_group(group)]
+    if missing:
+        return f'groups not found: {", ".join(missing)}'
+    return None
+
+
+def _get_valid_users(file_path, file_format=None, has_group=None, counts=None):
+    # the invalid rows are reported with their line number and skipped
+    for line_number, user in _read_users(file_path, file_format):
+        error = _get_user_error(user, has_group)
+        if error:
+            LOGGER.warning(f'- Line {line_number} of "{file_path}" skipped: {error}')
+            if counts is not None:
+                counts['skipped'] += 1
+            continue
+        yield _get_user_representation(user)
+
+
+def _get_user_representation(user):
+    # password and groups are set only to the new users by the partial import
+    user = dict(user)
+    password = user.pop('password', None)
+    temporary_password = _is_true(user.pop('temporary_password', False))
+    groups = user.pop('groups', None) or []
+
+    user['username'] = user['username'].strip().lower()
+    user['enabled'] = _is_true(user.get('enabled', True))
+    user['groups'] = [g if g.startswith('/') else f'/{g}' for g in groups]
+    if password:
+        user['credentials'] = [{'type': 'password', 'value': password, 'temporary': temporary_password}]
+    return user
+
+
+def _update_existing_user(realm, user_id, user):
+    keycloak_admin = client_for_realm(realm)
+    credentials = user.get('credentials')
+    if credentials:
+        keycloak_admin.set_user_password(
+            user_id=user_id,
+            password=credentials[0]['value'],
+            temporary=credentials[0]['temporary'],
+        )
+    for group in user['groups']:
+        group_id = get_group_id(realm, group)
+        if not group_id:
+            raise KeycloakGetError(f'Group "{group}" not found')
+        keycloak_admin.group_user_add(user_id=user_id, group_id=group_id)
+
+
+def create_users(realm, file_path, *args, kwargs={}):
+    check_realm(realm)
+
+    # the groups are checked before the import, the not found ones are not cached by the index
+    groups = {}
+
+    def _has_group(group):
+        if group not in groups:
+            groups[group] = bool(get_group_id(realm, group))
+        return groups[group]
+
+    counts = {'added': 0, 'updated': 0, 'failed': 0, 'skipped': 0}
+    users = _get_valid_users(file_path, kwargs.get('format'), _has_group, counts)
+    batch_size = int(kwargs.get('batch_size') or USERS_BATCH_SIZE)
+
+    if kwargs.get('test'):
+        for user in users:
+            user.pop('credentials', None)
+            LOGGER.debug(user)
+        return
+
+    LOGGER.info(f'Adding/Updating users from "{file_path}" to realm "{realm}"...')
+    keycloak_admin = client_for_realm(realm)
+    start = time.monotonic()
+
+    # the existing users are skipped by the partial import (they would be recreated
+    # with a new id otherwise), their password and groups are set by the workers
+    with ThreadPoolExecutor(max_workers=int(kwargs.get('concurrency') or KC_CONCURRENCY)) as executor:
+        while True:
+            batch = {user['username']: user for user in islice(users, batch_size)}
+            if not batch:
+                break
+
+            result = keycloak_admin.partial_import_realm(realm, {
+                'ifResourceExists': 'SKIP',
+                'users': list(batch.values()),
+            })
+            futures = []
+            for item in result.get('results', []):
+                if item.get('resourceType') != 'USER':
+                    continue
+                if item.get('action') == 'ADDED':
+                    counts['added'] += 1
+                elif item.get('resourceName') in batch:
+                    user = batch[item['resourceName']]
+                    futures.append(executor.submit(_update_existing_user, realm, item['id'], user))
+
+            for future in futures:
+                try:
+                    future.result()
+                    counts['updated'] += 1
+                except Exception as e:
+                    counts['failed'] += 1
+                    LOGGER.warning(f'- {str(e)}')
+
+            total = sum(counts.values())
+            LOGGER.info(f'{total} users processed ({total / (time.monotonic() - start):.1f} users/s)')
+
+    elapsed = time.monotonic() - start
+    summary = (
+        f'Realm "{realm}": {counts["added"]} users added, {counts["updated"]} updated,'
+        f' {counts["failed"]} failed, {counts["skipped"]} skipped'
+        f' in {elapsed:.2f}s ({sum(counts.values()) / max(elapsed, 0.001):.1f} users/s)'
+    )
+    if counts['failed']:
+        LOGGER.error(summary)
+    elif counts['skipped']:
+        LOGGER.warning(summary)
+    else:
+        LOGGER.success(summary)
+
+
+def _get_users_page(realm, first, size):
+    return client_for_realm(realm).get_users({'first': first, 'max': size})
+
+
+def _expand_user(realm, user, expand):
+    keycloak_admin = client_for_realm(realm)
+    if 'groups' in expand:
+        user['groups'] = [g['path'] for g in keycloak_admin.get_user_groups(user['id'])]
+    if 'roles' in expand:
+        user['realmRoles'] = [r['name'] for r in keycloak_admin.get_realm_roles_of_user(user['id'])]
+    return user
+
+
+def _get_users_writer(output, file_format, expand):
+    if file_format != 'csv':
+        return lambda user: output.write(json.dumps(user) + '\n')
+
+    # same columns as the import file
+    fields = list(USERS_CSV_FIELDS)
+    if 'groups' in expand:
+        fields.append('groups')
+    if 'roles' in expand:
+        fields.append('realmRoles')
+    writer = csv.DictWriter(output, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    return lambda user: writer.writerow({
+        **user,
+        'groups': USERS_CSV_GROUPS_SEPARATOR.join(user.get('groups', [])),
+        'realmRoles': USERS_CSV_GROUPS_SEPARATOR.join(user.get('realmRoles', [])),
+    })
+
+
+def export_users(realm, *args, kwargs={}):
+    check_realm(realm)
+
+    output_path = kwargs.get('output')
+    file_format = kwargs.get('format') or ('csv' if (output_path or '').lower().endswith('.csv') else 'jsonl')
+    expand = _get_list(kwargs.get('expand'))  # groups,roles
+    page_size = int(kwargs.get('page_size') or USERS_BATCH_SIZE)
+
+    if kwargs.get('test'):
+        LOGGER.debug(f'Exporting users of realm "{realm}" as {file_format}, expanding {expand}')
+        return
+
+    LOGGER.info(f'Exporting users of realm "{realm}"...')
+    output = open(output_path, 'w', newline='') if output_path else sys.stdout
+    total = 0
+    start = time.monotonic()
+
+    try:
+        write = _get_users_writer(output, file_format, expand)
+        with ThreadPoolExecutor(max_workers=int(kwargs.get('concurrency') or KC_CONCURRENCY)) as executor:
+            # the next page is fetched while the current one is expanded and written
+            next_page = executor.submit(_get_users_page, realm, 0, page_size)
+            while next_page:
+                users = next_page.result()
+                next_page = None
+                if len(users) == page_size:
+                    next_page = executor.submit(_get_users_page, realm, total + page_size, page_size)
+
+                if expand:
+                    users = executor.map(lambda user: _expand_user(realm, user, expand), users)
+                for user in users:
+                    write(user)
+                    total += 1
+
+                LOGGER.info(f'{total} users exported ({total / (time.monotonic() - start):.1f} users/s)')
+    finally:
+        if output_path:
+            output.close()
+
+    LOGGER.success(f'Exported {total} users of realm "{realm}" in {time.monotonic() - start:.2f}s')
+
+
 def create_confidential_client(realm, name, *args, kwargs={}):
     check_realm(realm)
 
@@ -285,9 +1059,7 @@ def create_public_client(realm, name, *args, kwargs={}):
     create_client(realm, name, True, *args, kwargs)
 
 
-def create_client(realm, name, isPublic, *args, kwargs={}):
-    check_realm(realm)
-
+def _get_client_config(realm, name, isPublic, kwargs={}):
     config = load_json_file(TEMPLATES['client'], {
         'name': name,
         'host': BASE_HOST,
@@ -301,24 +1073,182 @@ def create_client(realm, name, isPublic, *args, kwargs={}):
     if kwargs.get('login_theme'):
         config['attributes'] = config.get('attributes', {})
         config['attributes']['login_theme'] = kwargs['login_theme']
+    return config
+
+
+def create_client(realm, name, isPublic, *args, kwargs={}):
+    check_realm(realm)
 
+    config = _get_client_config(realm, name, isPublic, kwargs)
     if kwargs.get('test'):
         LOGGER.debug(config)
         return
 
     keycloak_admin = client_for_realm(realm)
     _status = keycloak_admin.create_client(config, skip_exists=True)
+    INDEX.invalidate(realm, 'client', name)
     if _status:
         LOGGER.warning(f'- {str(_status)}')
     LOGGER.success(f'Added client "{name}" to realm "{realm}"')
 
 
+def _get_list(value):
+    return [i.strip() for i in (value or '').split(',') if i.strip()]
+
+
+def _get_group_paths(groups, parent=''):
+    # paths of the groups and their subgroups
+    for group in groups:
+        path = f'{parent}/{group["name"]}'
+        yield path
+        yield from _get_group_paths(group.get('subGroups') or [], path)
+
+
+def _get_bootstrap_config(realm, kwargs={}):
+    # realm, roles and groups from the realm template
+    config = _get_realm_config(realm, kwargs)
+
+    config['clients'] = [
+        _get_client_config(realm, name, False, kwargs)
+        for name in _get_list(kwargs.get('confidential_clients'))
+    ] + [
+        _get_client_config(realm, name, True, kwargs)
+        for name in _get_list(kwargs.get('public_clients'))
+    ]
+
+    users = []
+    if kwargs.get('admin'):
+        admin = _get_user_representation({
+            'username': kwargs['admin'],
+            'password': kwargs.get('admin_password'),
+            'temporary_password': kwargs.get('temporary_password'),
+        })
+        # same rights as "create_admin", "realm-admin" is the composite of all of them
+        admin['clientRoles'] = {'realm-management': ['realm-admin']}
+        users.append(admin)
+    if kwargs.get('users_file'):
+        # the users of groups missing in the realm template would fail the whole import
+        group_paths = set(_get_group_paths(config.get('groups') or []))
+        users += list(_get_valid_users(
+            kwargs['users_file'],
+            has_group=lambda group: (group if group.startswith('/') else f'/{group}') in group_paths,
+        ))
+    config['users'] = users
+
+    return config
+
+
+def bootstrap_realm(realm, *args, kwargs={}):
+    # the realm with its clients, roles, groups and users in one call,
+    # if the realm already exists the missing parts are added with one partial import
+    check_realm(realm)
+
+    config = _get_bootstrap_config(realm, kwargs)
+    if kwargs.get('test'):
+        for user in config['users']:
+            user.pop('credentials', None)
+        LOGGER.debug(config)
+        return
+
+    LOGGER.info(f'Bootstrapping realm "{realm}"...')
+    keycloak_admin = get_client()
+
+    _status = keycloak_admin.create_realm(config, skip_exists=True)
+    INDEX.invalidate(realm)
+    invalidate_client_secret(realm)
+    REALMS.invalidate(realm)
+    if not _status:
+        LOGGER.success(
+            f'Added realm "{realm}" with {len(config["clients"])} clients'
+            f' and {len(config["users"])} users'
+        )
+        return
+
+    LOGGER.warning(f'- {str(_status)}')
+    LOGGER.info(f'Adding missing clients, roles, groups and users to realm "{realm}"...')
+    result = keycloak_admin.partial_import_realm(realm, {
+        'ifResourceExists': 'OVERWRITE' if kwargs.get('overwrite') else 'SKIP',
+        'clients': config['clients'],
+        'roles': config['roles'],
+        'groups': config['groups'],
+        'users': config['users'],
+    })
+    INDEX.invalidate(realm)
+    invalidate_client_secret(realm)
+    REALMS.invalidate(realm)
+    LOGGER.success(
+        f'Updated realm "{realm}": {result.get("added", 0)} added,'
+        f' {result.get("overwritten", 0)} overwritten, {result.get("skipped", 0)} skipped'
+    )
+
+
+def _read_realm_specs(file_path):
+    # one realm per line: the realm name or a JSON object with the "bootstrap_realm" arguments
+    with open(file_path) as _f:
+        for line in _f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if not line.startswith('{'):
+                yield {'realm': line}
+                continue
+            spec = json.loads(line)
+            yield {
+                k: ','.join(v) if isinstance(v, list) else v
+                for k, v in spec.items()
+            }
+
+
+def bootstrap_realms(file_path, *args, kwargs={}):
+    # the command arguments are the defaults of each realm spec
+    defaults = {k: v for k, v in kwargs.items() if k != 'concurrency'}
+    specs = [{**defaults, **spec} for spec in _read_realm_specs(file_path)]
+    if not specs:
+        LOGGER.warning(f'No realms in "{file_path}"')
+        return
+
+    def _bootstrap(spec):
+        realm = spec.pop('realm')
+        start = time.monotonic()
+        try:
+            bootstrap_realm(realm, kwargs=spec)
+            return realm, None, time.monotonic() - start
+        except (Exception, SystemExit) as e:
+            # the other realms go on
+            LOGGER.error(f'Could not bootstrap realm "{realm}": {str(e)}')
+            return realm, e, time.monotonic() - start
+
+    if not kwargs.get('test'):
+        get_client()  # login once, all the workers share the token
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=int(kwargs.get('concurrency') or KC_CONCURRENCY)) as executor:
+        results = list(executor.map(_bootstrap, specs))
+
+    for realm, error, elapsed in results:
+        if error is None:
+            LOGGER.success(f'Realm "{realm}": done in {elapsed:.2f}s')
+        else:
+            LOGGER.error(f'Realm "{realm}": failed in {elapsed:.2f}s')
+
+    failed = len([r for r in results if r[1] is not None])
+    summary = f'{len(results) - failed} realms bootstrapped, {failed} failed in {time.monotonic() - start:.2f}s'
+    if failed:
+        LOGGER.error(summary)
+        sys.exit(1)
+    LOGGER.success(summary)
+
+
 if __name__ == '__main__':
     COMMANDS: Dict[str, Callable] = {
         'READY': do_nothing,
         'ADD_REALM': create_realm,
+        'BOOTSTRAP_REALM': bootstrap_realm,
+        'BOOTSTRAP_REALMS': bootstrap_realms,
         'ADD_ADMIN': create_admin,
         'ADD_USER': create_user,
+        'ADD_USERS': create_users,
+        'EXPORT_USERS': export_users,
         'ADD_USER_GROUP': add_user_group,
         'ADD_CONFIDENTIAL_CLIENT': create_confidential_client,
         'ADD_PUBLIC_CLIENT': create_public_client,
@@ -337,6 +1267,7 @@ if __name__ == '__main__':
         fn = COMMANDS[command]
         args = args[2:]
         fn(*args, kwargs=kwargs or {})
+        log_admin_stats(LOGGER)
     except Exception as e:
         LOGGER.error(str(e))
         sys.exit(1)
@@ -18,20 +18,33 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import asyncio
+import hashlib
+import json
+import os
 import sys
+import time
 
+from threading import Lock
 from typing import Callable, Dict
+from urllib.parse import urlsplit
 
+from httpx import HTTPStatusError
 from requests.exceptions import HTTPError
 
-from manage_keycloak import get_client_secret
+from kong_snapshot import KongSnapshot, get_all
+from manage_keycloak import a_get_client_secret, get_client_secret, log_admin_stats
 from helpers import (
+    async_request,
     categorize_arguments,
     check_realm,
     do_nothing,
     fill_template,
+    get_async_client,
     get_logger,
     load_json_file,
+    log_connection_stats,
+    log_template_stats,
     request,
 )
 from settings import (
@@ -39,6 +52,7 @@ from settings import (
     BASE_DOMAIN,
     BASE_USE_SSL,
 
+    KONG_CONCURRENCY,
     KONG_INTERNAL_URL,
     KONG_PUBLIC_REALM,
 
@@ -54,21 +68,85 @@ EPT_PUBLIC = 'public'
 
 ENDPOINT_TYPES = [EPT_PUBLIC, EPT_OIDC]
 
+# declarative configuration (DB-less mode)
+KONG_DECLARATIVE_FORMAT_VERSION = '1.1'
+DECLARATIVE_ARRAY_FIELDS = [
+    # routes
+    'hosts', 'paths', 'tags',
+    # CORS plugin
+    'exposed_headers', 'headers', 'methods', 'origins',
+    # OIDC plugin
+    'allowed_roles', 'user_keys',
+]
+DECLARATIVE_NUMBER_FIELDS = [
+    'connect_timeout', 'read_timeout', 'write_timeout',
+    'regex_priority',
+    'max_age',
+]
+
+# service tags with the hash of the applied configuration (the realm is empty
+# for the realm independent part) "gwm-hash~{realm}~{hash}"
+HASH_TAG = 'gwm-hash'
+HASH_LENGTH = 16
+
+# realm routes status
+ROUTE_ADDED = 'added'
+ROUTE_EXISTS = 'existing'
+ROUTE_FAILED = 'failed'
+
+ROUTE_STATUSES = [ROUTE_ADDED, ROUTE_EXISTS, ROUTE_FAILED]
+
 LOGGER = get_logger('Kong')
 
+# Kong state, loaded once per command
+SNAPSHOT = None
 
-def _get_service_oidc_payload(service_name, realm, client_id):
-    client_secret = get_client_secret(realm, client_id)
+# rendered OIDC plugin settings by (realm, client id, client secret)
+_OIDC_PAYLOADS = {}
+_OIDC_PAYLOADS_LOCK = Lock()
 
-    return load_json_file(TEMPLATES['oidc'], {
-        'host': BASE_HOST,
-        'domain': BASE_DOMAIN,
-        'use_ssl': str(BASE_USE_SSL).lower(),
-        'realm': realm,
-        'oidc_client_id': client_id,
-        'oidc_client_secret': client_secret,
-        'service': service_name,
-    })
+
+def get_snapshot():
+    global SNAPSHOT
+
+    if SNAPSHOT is None:
+        SNAPSHOT = KongSnapshot().load()
+    return SNAPSHOT
+
+
+def _get_realm_oidc_payload(realm, client_id, client_secret=None):
+    # rendered once per client secret, the service name is set per service
+    client_secret = client_secret or get_client_secret(realm, client_id)
+    key = (realm, client_id, client_secret)
+
+    with _OIDC_PAYLOADS_LOCK:
+        if key not in _OIDC_PAYLOADS:
+            # drop the payloads with the previous secret
+            for other in [k for k in _OIDC_PAYLOADS if k[:2] == key[:2]]:
+                _OIDC_PAYLOADS.pop(other)
+            _OIDC_PAYLOADS[key] = load_json_file(TEMPLATES['oidc'], {
+                'host': BASE_HOST,
+                'domain': BASE_DOMAIN,
+                'use_ssl': str(BASE_USE_SSL).lower(),
+                'realm': realm,
+                'oidc_client_id': client_id,
+                'oidc_client_secret': client_secret,
+            })
+        return _OIDC_PAYLOADS[key]
+
+
+def _get_service_oidc_payload(service_name, realm, client_id, client_secret=None):
+    return {
+        k: v.replace('${service}', service_name) if isinstance(v, str) else v
+        for k, v in _get_realm_oidc_payload(realm, client_id, client_secret).items()
+    }
+
+
+def _get_oidc_plugin_data(oidc_data, ep):
+    _oidc_config = {}
+    _oidc_config.update(oidc_data)
+    _oidc_config.update(ep.get('oidc_override', {}))
+    return _oidc_config
 
 
 def _check_realm_in_action(action, realm):
@@ -85,256 +163,457 @@ def _check_realm_in_action(action, realm):
     return realm
 
 
-def _check_404(url):
-    try:
-        request(method='get', url=url, ignore_404=True)
-        return False
-    except HTTPError as he:
-        if he.response.status_code != 404:
-            raise he
-        return True
+def get_services_by_realm(realm):
+    if SNAPSHOT is not None:
+        return SNAPSHOT.get_services_by_realm(realm)
+
+    # the realm routes are tagged with the realm
+    routes = get_all(f'{KONG_INTERNAL_URL}/routes', tags=realm)
+    if not routes:
+        # the old ones (without tags) have the realm as name suffix
+        routes = [
+            route
+            for route in get_all(f'{KONG_INTERNAL_URL}/routes')
+            if route.get('tags') is None and (route.get('name') or '').endswith(f'__{realm}')
+        ]
+    if not routes:
+        return []
+
+    service_ids = {(route.get('service') or {}).get('id') for route in routes}
+    return [
+        service['name']
+        for service in get_all(f'{KONG_INTERNAL_URL}/services')
+        if service['id'] in service_ids
+    ]
+
+
+def _get_route_name(*parts):
+    # route names contain only [A-Za-z0-9_]
+    route_name = '__'.join(parts)
+    return ''.join([c if c.isalnum() else '_' for c in route_name])
+
+
+def _get_service_data(config):
+    service_data = {
+        'name': config['name'],
+        'url': config['host'],
+    }
 
+    timeout = config.get('timeout', 0)
+    if timeout:
+        service_data['connect_timeout'] = timeout
+        service_data['read_timeout'] = timeout
+        service_data['write_timeout'] = timeout
 
-def get_services_by_realm(realm):
-    def _service_in_realm(service):
-        def _realm_in_route(route):
-            if route.get('tags', []) is not None:
-                return realm in route.get('tags', [])
-            else:
-                return route['name'].endswith(f'__{realm}')
+    return service_data
 
-        try:
-            url = f'{KONG_INTERNAL_URL}/services/{service}/routes'
-            while url:
-                res = request(method='get', url=url)
-                url = res['next']
-
-                for route in res['data']:
-                    if _realm_in_route(route):
-                        return True
-        except HTTPError:
-            pass
 
-        return False
+def _get_public_route_data(config):
+    # the public routes (non realm dependant)
+    name = config['name']
+    context = {
+        'public_realm': KONG_PUBLIC_REALM,
+        'name': name,
+    }
+    paths = [fill_template(p, context) for p in config.get('paths', [])]
+    if not paths:
+        return None
+
+    return {
+        'name': _get_route_name(BASE_DOMAIN, name),
+        'hosts': [BASE_DOMAIN, ],
+        'preserve_host': 'true',
+        'paths': paths,
+        'strip_path': config.get('strip_path', 'false'),
+        'regex_priority': config.get('regex_priority', 0),
+        'tags': [BASE_DOMAIN, ]  # use tags to identify assigned host
+    }
+
+
+def _get_realm_routes_data(service_config, realm):
+    # yields the realm routes as tuples (endpoint type, endpoint, route data)
+    name = service_config['name']
+    ep_types = [ept for ept in ENDPOINT_TYPES if service_config.get(f'{ept}_endpoints')]
+    for ep_type in ep_types:
+        context = {
+            'realm': realm,
+            'name': name,
+        }
+        if ep_type != EPT_OIDC:  # not available in protected routes
+            context['public_realm'] = KONG_PUBLIC_REALM
+
+        for ep in service_config.get(f'{ep_type}_endpoints', []):
+            route_data = {
+                'name': _get_route_name(BASE_DOMAIN, name, ep_type, ep['name'], realm),
+                'hosts': [BASE_DOMAIN, ],
+                'preserve_host': 'true',
+                'paths': [fill_template(p, context) for p in ep.get('paths')],
+                'strip_path': ep.get('strip_path', 'false'),
+                'regex_priority': ep.get('regex_priority', 0),
+                'tags': [BASE_DOMAIN, realm, ]  # use tags to identify assigned host and realm
+            }
+            yield ep_type, ep, route_data
+
+
+def _get_config_hash(*data):
+    # stable hash of the rendered configuration
+    content = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()[:HASH_LENGTH]
+
+
+def _get_service_hash(config):
+    # the realm independent part: service, CORS plugin and public routes
+    return _get_config_hash(
+        _get_service_data(config),
+        _get_public_route_data(config),
+        load_json_file(TEMPLATES['cors'], {'host': BASE_HOST}),
+    )
+
+
+def _get_realm_hash(service_config, realm, oidc_client, client_secret=None):
+    # the realm routes and the OIDC plugin settings (the client secret as a digest)
+    return _get_config_hash(
+        service_config,
+        realm,
+        oidc_client,
+        hashlib.sha256((client_secret or '').encode()).hexdigest(),
+        BASE_HOST,
+        BASE_DOMAIN,
+        load_json_file(TEMPLATES['oidc']),
+    )
+
+
+def _get_realm_client_secret(service_config, realm, oidc_client):
+    # only the services with OIDC endpoints use it
+    if service_config.get(f'{EPT_OIDC}_endpoints') and oidc_client:
+        return get_client_secret(realm, oidc_client)
+    return None
+
+
+def _get_hash_tag_prefix(realm=None):
+    # tags contain only [A-Za-z0-9_.-~]
+    realm = ''.join([c if c.isalnum() or c in '_.-' else '_' for c in realm or ''])
+    return f'{HASH_TAG}~{realm}~'
+
 
-    available_services = []
-    url = f'{KONG_INTERNAL_URL}/services'
-    if not _check_404(url):
-        while url:
-            res = request(method='get', url=url)
-            url = res['next']
+def _is_unchanged(name, config_hash, realm=None):
+    service = get_snapshot().get_service(name)
+    return bool(service) and f'{_get_hash_tag_prefix(realm)}{config_hash}' in (service.get('tags') or [])
 
-            _services = res['data'] if 'data' in res else []
-            available_services += [
-                service['name']
-                for service in _services
-                if _service_in_realm(service['name'])
-            ]
-    return available_services
 
+def _replace_hash_tags(current_tags, hashes):
+    # hashes: {realm: hash}, with hash None to remove the realm tag
+    # returns the new list of service tags or None if there are no changes
+    prefixes = tuple(_get_hash_tag_prefix(realm) for realm in hashes)
+    tags = [tag for tag in current_tags if not tag.startswith(prefixes)]
+    tags += [
+        f'{_get_hash_tag_prefix(realm)}{config_hash}'
+        for realm, config_hash in hashes.items()
+        if config_hash
+    ]
+    return tags if set(tags) != set(current_tags) else None
 
-def _add_service(config):
+
+def _get_hash_tags(name, hashes):
+    service = get_snapshot().get_service(name)
+    if not service:
+        return None
+    return _replace_hash_tags(service.get('tags') or [], hashes)
+
+
+def _set_hash_tags(name, hashes):
+    tags = _get_hash_tags(name, hashes)
+    if tags is None:
+        return
+
+    try:
+        # JSON payload to be able to empty the list
+        service_info = request(method='patch', url=f'{KONG_INTERNAL_URL}/services/{name}', json={'tags': tags})
+        get_snapshot().add_service(service_info)
+    except HTTPError:
+        LOGGER.warning(f'Could not update the configuration hash of service "{name}"')
+
+
+def _add_service(config, force=False):
     name = config['name']  # service name
     host = config['host']  # service host
 
+    config_hash = _get_service_hash(config)
+    if not force and _is_unchanged(name, config_hash):
+        LOGGER.info(f'Service "{name}" at {host} is up to date, skipping...')
+        return
+
     LOGGER.info(f'Exposing service "{name}" at {host}...')
+    snapshot = get_snapshot()
 
     try:
-        if not _check_404(f'{KONG_INTERNAL_URL}/services/{name}'):
-            LOGGER.warning(f'Service "{name}" already exists!')
-        else:
+        service = snapshot.get_service(name)
+        service_data = _get_service_data(config)
+        if not service:
             # Register service
-            service_data = {
-                'name': name,
-                'url': host,
-            }
-
-            timeout = config.get('timeout', 0)
-            if timeout:
-                service_data['connect_timeout'] = timeout
-                service_data['read_timeout'] = timeout
-                service_data['write_timeout'] = timeout
-
             service_info = request(method='post', url=f'{KONG_INTERNAL_URL}/services/', data=service_data)
+            snapshot.add_service(service_info)
             service_id = service_info['id']
             LOGGER.success(f'Added service "{name}": {service_id}')
+        elif not _same_entity(_split_service_url(service_data), service):
+            snapshot.add_service(request(method='patch', url=f'{KONG_INTERNAL_URL}/services/{name}', data=service_data))
+            LOGGER.success(f'Updated service "{name}"')
+        else:
+            LOGGER.warning(f'Service "{name}" already exists!')
 
         # Add CORS plugin for whole domain
         _add_service_plugin(name)
 
         # Add the public routes (non realm dependant)
-        context = {
-            'public_realm': KONG_PUBLIC_REALM,
-            'name': name,
-        }
-        paths = [fill_template(p, context) for p in config.get('paths', [])]
-        if paths:
-            # check route (route names contain only [A-Za-z0-9_])
-            route_name = f'{BASE_DOMAIN}__{name}'
-            route_name = ''.join([c if c.isalnum() else '_' for c in route_name])
-            if not _check_404(f'{KONG_INTERNAL_URL}/services/{name}/routes/{route_name}'):
-                LOGGER.warning(f'Route "{route_name}" for service "{name}" already exists!')
-                return
-
-            route_data = {
-                'name': route_name,
-                'hosts': [BASE_DOMAIN, ],
-                'preserve_host': 'true',
-                'paths': paths,
-                'strip_path': config.get('strip_path', 'false'),
-                'regex_priority': config.get('regex_priority', 0),
-                'tags': [BASE_DOMAIN, ]  # use tags to identify assigned host
-            }
+        route_data = _get_public_route_data(config)
+        if route_data:
+            # check route
+            route = snapshot.get_route(route_data['name'])
+            if route:
+                if _update_route(name, route, route_data) == ROUTE_FAILED:
+                    return  # the configuration hash is not stored
+            else:
+                paths = route_data['paths']
+                ROUTE_URL = f'{KONG_INTERNAL_URL}/services/{name}/routes'
+                snapshot.add_route(request(method='post', url=ROUTE_URL, data=route_data))
+                LOGGER.success(f'Route paths {paths} now being served at {BASE_HOST}')
 
-            ROUTE_URL = f'{KONG_INTERNAL_URL}/services/{name}/routes'
-            request(method='post', url=ROUTE_URL, data=route_data)
-            LOGGER.success(f'Route paths {paths} now being served at {BASE_HOST}')
+        _set_hash_tags(name, {None: config_hash})
 
     except Exception as e:
         LOGGER.critical(f'Could not add service "{name}"')
         raise e
 
 
-def _add_service_plugin(name):
-    # Add CORS plugin for whole domain
+def _get_cors_plugin_data(name):
     # get all plugins, if CORS already added, put BASE_HOST in the list of available origins
+    # returns the new plugin data and the current plugin (to be replaced)
     cors_data = load_json_file(TEMPLATES['cors'], {'host': BASE_HOST})
+
+    for plugin in get_snapshot().get_service_plugins(name):
+        if plugin['name'] == 'cors':
+            # update origins list
+            if isinstance(cors_data['config.origins'], str):
+                cors_data['config.origins'] = [cors_data['config.origins'], ]
+            cors_data['config.origins'] += plugin['config']['origins']
+            # remove possible duplicates
+            cors_data['config.origins'] = list(set(cors_data['config.origins']))
+            return cors_data, plugin
+
+    return cors_data, None
+
+
+def _add_service_plugin(name):
+    # Add CORS plugin for whole domain
     PLUGIN_URL = f'{KONG_INTERNAL_URL}/services/{name}/plugins'
+    snapshot = get_snapshot()
+
+    cors_data, plugin = _get_cors_plugin_data(name)
+    if plugin:
+        # remove entry
+        _plugin_id = plugin['id']
+        request(method='delete', url=f'{PLUGIN_URL}/{_plugin_id}')
+        snapshot.remove_plugin(_plugin_id)
 
-    next_url = PLUGIN_URL
-    while next_url:
-        res = request(method='get', url=next_url)
-        next_url = res['next']
-
-        for plugin in res['data']:
-            if plugin['name'] == 'cors':
-                # update origins list
-                if isinstance(cors_data['config.origins'], str):
-                    cors_data['config.origins'] = [cors_data['config.origins'], ]
-                cors_data['config.origins'] += plugin['config']['origins']
-                # remove possible duplicates
-                cors_data['config.origins'] = list(set(cors_data['config.origins']))
-
-                # remove entry
-                _plugin_id = plugin['id']
-                request(method='delete', url=f'{PLUGIN_URL}/{_plugin_id}')
-                next_url = None
-                break
-
-    request(method='post', url=PLUGIN_URL, data=cors_data)
+    snapshot.add_plugin(request(method='post', url=PLUGIN_URL, data=cors_data))
     LOGGER.success(f'Added CORS plugin to service "{name}"')
 
 
 def _remove_service_and_routes(name, routes_fn=None):
     LOGGER.info(f'Removing service "{name}"...')
+    snapshot = get_snapshot()
 
-    if _check_404(f'{KONG_INTERNAL_URL}/services/{name}'):
+    service_info = snapshot.get_service(name)
+    if not service_info:
         LOGGER.warning(f'Service "{name}" does not exist!')
         return
 
     try:
-        service_info = request(method='get', url=f'{KONG_INTERNAL_URL}/services/{name}')
         service_id = service_info['id']
 
         # first remove all linked routes
-        next_url = f'{KONG_INTERNAL_URL}/services/{name}/routes'
-        while next_url:
-            res = request(method='get', url=next_url)
-            next_url = res['next']
-
-            for route in res['data']:
-                route_id = route['id']
-                route_name = route['name']
-
-                # check if the route fits the condition to be removed
-                if not routes_fn or routes_fn(route):
-                    try:
-                        request(method='delete', url=f'{KONG_INTERNAL_URL}/routes/{route_id}')
-                        LOGGER.success(f'Removed route "{route_name}" ({route_id})')
-                    except HTTPError:
-                        LOGGER.warning(f'Could not remove route "{route_name}"')
+        for route in snapshot.get_service_routes(name):
+            route_id = route['id']
+            route_name = route['name']
+
+            # check if the route fits the condition to be removed
+            if not routes_fn or routes_fn(route):
+                try:
+                    request(method='delete', url=f'{KONG_INTERNAL_URL}/routes/{route_id}')
+                    snapshot.remove_route(route_id)
+                    LOGGER.success(f'Removed route "{route_name}" ({route_id})')
+                except HTTPError:
+                    LOGGER.warning(f'Could not remove route "{route_name}"')
 
         request(method='delete', url=f'{KONG_INTERNAL_URL}/services/{service_id}')
+        snapshot.remove_service(name)
         LOGGER.success(f'Removed service "{name}"')
 
     except HTTPError:
         LOGGER.critical(f'Could not remove service "{name}"')
 
 
-def add_service(service_config, realm, oidc_client):
-    # Register service
-    _add_service(service_config)
+def _get_realm_oidc_data(service_config, realm, oidc_client):
+    # OIDC plugin settings (same for all OIDC endpoints)
+    if not service_config.get(f'{EPT_OIDC}_endpoints'):
+        return {}
+
+    if not oidc_client:
+        LOGGER.critical('Cannot execute command without OIDC client')
+        sys.exit(1)
+    return _get_service_oidc_payload(service_config['name'], realm, oidc_client)
+
+
+def _get_route_updates(route, route_data, plugin_data=None):
+    # calls needed to bring the existing route (and its plugin) up to date,
+    # as (method, url, data, snapshot function)
+    snapshot = get_snapshot()
+    updates = []
+    if not _same_entity(route_data, route):
+        updates.append(('patch', f'{KONG_INTERNAL_URL}/routes/{route["id"]}', route_data, snapshot.add_route))
+    if plugin_data:
+        plugin = _find_plugin(snapshot, plugin_data['name'], 'route', route['name'])
+        if not plugin:
+            updates.append((
+                'post', f'{KONG_INTERNAL_URL}/routes/{route["id"]}/plugins', plugin_data, snapshot.add_plugin,
+            ))
+        elif not _same_entity(plugin_data, plugin):
+            updates.append(('patch', f'{KONG_INTERNAL_URL}/plugins/{plugin["id"]}', plugin_data, snapshot.add_plugin))
+    return updates
+
+
+def _update_route(name, route, route_data, plugin_data=None):
+    # the existing route is updated if its settings changed
+    route_name = route['name']
+    updates = _get_route_updates(route, route_data, plugin_data)
+    if not updates:
+        LOGGER.warning(f'Route "{route_name}" for service "{name}" already exists!')
+        return ROUTE_EXISTS
+
+    try:
+        for method, url, data, add_fn in updates:
+            add_fn(request(method=method, url=url, data=data))
+        LOGGER.success(f'Updated route "{route_name}" for service "{name}"')
+        return ROUTE_EXISTS
+    except HTTPError:
+        LOGGER.error(f'Could not update route "{route_name}"')
+        return ROUTE_FAILED
+
 
+def _add_realm_routes(service_config, realm, oidc_client):
     name = service_config['name']  # service name
 
     LOGGER.info(f'Exposing service "{name}" routes for realm "{realm}"...')
     ROUTE_URL = f'{KONG_INTERNAL_URL}/services/{name}/routes'
+    snapshot = get_snapshot()
 
-    # OIDC plugin settings (same for all OIDC endpoints)
-    oidc_data = {}
-    if service_config.get(f'{EPT_OIDC}_endpoints'):
-        if not oidc_client:
-            LOGGER.critical('Cannot execute command without OIDC client')
-            sys.exit(1)
-        oidc_data = _get_service_oidc_payload(name, realm, oidc_client)
+    oidc_data = _get_realm_oidc_data(service_config, realm, oidc_client)
+    result = {status: 0 for status in ROUTE_STATUSES}
 
-    ep_types = [ept for ept in ENDPOINT_TYPES if service_config.get(f'{ept}_endpoints')]
-    for ep_type in ep_types:
-        LOGGER.info(f'Adding {ep_type} endpoints...')
+    for ep_type, ep, route_data in _get_realm_routes_data(service_config, realm):
+        route_name = route_data['name']
+        paths = route_data['paths']
 
-        context = {
-            'realm': realm,
-            'name': name,
-        }
-        if ep_type != EPT_OIDC:  # not available in protected routes
-            context['public_realm'] = KONG_PUBLIC_REALM
+        # check route
+        route = snapshot.get_route(route_name)
+        if route:
+            plugin_data = _get_oidc_plugin_data(oidc_data, ep) if ep_type == EPT_OIDC else None
+            result[_update_route(name, route, route_data, plugin_data)] += 1
+            continue
 
-        for ep in service_config.get(f'{ep_type}_endpoints', []):
-            ep_name = ep['name']
-            route_name = f'{BASE_DOMAIN}__{name}__{ep_type}__{ep_name}__{realm}'
-            route_name = ''.join([c if c.isalnum() else '_' for c in route_name])
+        try:
+            route_info = request(method='post', url=ROUTE_URL, data=route_data)
+            snapshot.add_route(route_info)
+            LOGGER.success(f'Route paths {paths} now being served at {BASE_HOST}')
 
-            # check route
-            if not _check_404(f'{KONG_INTERNAL_URL}/services/{name}/routes/{route_name}'):
-                LOGGER.warning(f'Route "{route_name}" for service "{name}" already exists!')
-                continue
+            # OIDC routes are protected using the "Kong-oidc-auth" plugin
+            if ep_type == EPT_OIDC:
+                protected_route_id = route_info['id']
+                _oidc_config = _get_oidc_plugin_data(oidc_data, ep)
+
+                try:
+                    snapshot.add_plugin(request(
+                        method='post',
+                        url=f'{KONG_INTERNAL_URL}/routes/{protected_route_id}/plugins',
+                        data=_oidc_config,
+                    ))
+                    LOGGER.success(f'Route paths {paths} now being protected')
+                except HTTPError:
+                    LOGGER.error(f'Could not protect route paths {paths}')
+                    result[ROUTE_FAILED] += 1
+                    continue
+
+            result[ROUTE_ADDED] += 1
 
-            paths = [fill_template(p, context) for p in ep.get('paths')]
-            route_data = {
-                'name': route_name,
-                'hosts': [BASE_DOMAIN, ],
-                'preserve_host': 'true',
-                'paths': paths,
-                'strip_path': ep.get('strip_path', 'false'),
-                'regex_priority': ep.get('regex_priority', 0),
-                'tags': [BASE_DOMAIN, realm, ]  # use tags to identify assigned host and realm
-            }
+        except HTTPError:
+            LOGGER.error(f'Could not add route paths {paths}')
+            result[ROUTE_FAILED] += 1
 
-            try:
-                route_info = request(method='post', url=ROUTE_URL, data=route_data)
-                LOGGER.success(f'Route paths {paths} now being served at {BASE_HOST}')
+    LOGGER.success(f'Service "{name}" routes now being served and protected for realm "{realm}"')
+    return result
 
-                # OIDC routes are protected using the "Kong-oidc-auth" plugin
-                if ep_type == EPT_OIDC:
-                    protected_route_id = route_info['id']
-                    _oidc_config = {}
-                    _oidc_config.update(oidc_data)
-                    _oidc_config.update(ep.get('oidc_override', {}))
-
-                    try:
-                        request(
-                            method='post',
-                            url=f'{KONG_INTERNAL_URL}/routes/{protected_route_id}/plugins',
-                            data=_oidc_config,
-                        )
-                        LOGGER.success(f'Route paths {paths} now being protected')
-                    except HTTPError:
-                        LOGGER.error(f'Could not protect route paths {paths}')
 
-            except HTTPError:
-                LOGGER.error(f'Could not add route paths {paths}')
+def _merge_results(results, other):
+    for realm, result in other.items():
+        results.setdefault(realm, {status: 0 for status in ROUTE_STATUSES})
+        for status, count in result.items():
+            results[realm][status] += count
+    return results
 
-    LOGGER.success(f'Service "{name}" routes now being served and protected for realm "{realm}"')
+
+def _log_results(results):
+    for realm, result in results.items():
+        summary = (
+            f'Realm "{realm}": {result[ROUTE_ADDED]} routes added,'
+            f' {result[ROUTE_EXISTS]} already existing, {result[ROUTE_FAILED]} failed'
+        )
+        if result[ROUTE_FAILED]:
+            LOGGER.error(summary)
+        else:
+            LOGGER.success(summary)
+
+
+def _get_unchanged_result(service_config, realm):
+    LOGGER.info(f'Service "{service_config["name"]}" routes for realm "{realm}" are up to date, skipping...')
+    result = {status: 0 for status in ROUTE_STATUSES}
+    result[ROUTE_EXISTS] = len(list(_get_realm_routes_data(service_config, realm)))
+    return result
+
+
+def add_service(service_config, realm, oidc_client, force=False):
+    return add_service_realms({realm: service_config}, oidc_client, force)[realm]
+
+
+def add_service_realms(configs, oidc_client, force=False):
+    # configs: {realm: service config}
+    # the service, its CORS plugin and its public routes do not depend on the realm
+    # and are added only once, after that the realm routes in a single pass
+    service_config = next(iter(configs.values()))
+    name = service_config['name']
+    _add_service(service_config, force)
+
+    results = {}
+    hashes = {}
+    for realm, service_config in configs.items():
+        client_secret = _get_realm_client_secret(service_config, realm, oidc_client)
+        config_hash = _get_realm_hash(service_config, realm, oidc_client, client_secret)
+        if not force and _is_unchanged(name, config_hash, realm):
+            results[realm] = _get_unchanged_result(service_config, realm)
+            continue
+
+        results[realm] = _add_realm_routes(service_config, realm, oidc_client)
+        if not results[realm][ROUTE_FAILED]:
+            hashes[realm] = config_hash
+
+    _set_hash_tags(name, hashes)
+    return results
+
+
+def add_services(services_configs, oidc_client, force=False):
+    results = {}
+    for configs in services_configs:
+        _merge_results(results, add_service_realms(configs, oidc_client, force))
+    return results
 
 
 def remove_service(name, realm):
@@ -353,80 +632,904 @@ def remove_service(name, realm):
 
     routes_fn = None if not realm else _realm_in_route
     _remove_service_and_routes(name, routes_fn)
+    if realm:
+        # the service is still used by other realms
+        _set_hash_tags(name, {realm: None})
 
 
-def handle_app(action, name, *args, kwargs={}):
+def _load_app_config(name):
     try:
-        app_config = load_json_file(f'{APPS_PATH}/{name}.json')
+        return load_json_file(f'{APPS_PATH}/{name}.json')
     except Exception:
         LOGGER.critical(f'No app definition for name: "{name}"')
         sys.exit(1)
 
+
+def _load_service_config(name, realm, kwargs={}):
+    try:
+        config = load_json_file(f'{SERVICES_PATH}/{name}.json')
+        service_name = kwargs.get('service_name') or config['name']
+        service_url = kwargs.get('service_url') or config['host']
+    except Exception:
+        LOGGER.critical(f'No service definition for name: "{name}"')
+        sys.exit(1)
+
+    if not realm:
+        return config
+
+    # load again an substitute the possible string templates
+    return load_json_file(f'{SERVICES_PATH}/{name}.json', {
+        'host': BASE_HOST,
+        'domain': BASE_DOMAIN,
+        'realm': realm,
+        'service': service_name,
+        'name': name,
+        'service_url': service_url
+    })
+
+
+def _load_solution_services(name):
+    try:
+        return load_json_file(f'{SOLUTIONS_PATH}/{name}.json').get('services', [])
+    except Exception:
+        LOGGER.critical(f'No solution definition for name: "{name}"')
+        sys.exit(1)
+
+
+def handle_app(action, name, *args, kwargs={}):
+    app_config = _load_app_config(name)
+
     if kwargs.get('test'):
         LOGGER.debug(app_config)
         return
 
     if action == 'ADD':
-        _add_service(app_config)
+        _add_service(app_config, bool(kwargs.get('force')))
 
     elif action == 'REMOVE':
         service_name = app_config['name']
         _remove_service_and_routes(service_name)
 
 
-def handle_service(action, name, realm=None, oidc_client=None, *args, kwargs={}):
-    try:
-        config = load_json_file(f'{SERVICES_PATH}/{name}.json')
-        service_name = kwargs.get('service_name') or config['name']
-        service_url = kwargs.get('service_url') or config['host']
-    except Exception:
-        LOGGER.critical(f'No service definition for name: "{name}"')
-        sys.exit(1)
+def _get_realms(action, realm, kwargs={}):
+    # the realm argument can be a comma separated list of realms
+    # and the "realms_file" argument a file with one realm per line
+    realms = [r.strip() for r in (realm or '').split(',') if r.strip()]
+    if kwargs.get('realms_file'):
+        try:
+            with open(kwargs['realms_file']) as _f:
+                realms += [r.strip() for r in _f if r.strip() and not r.startswith('#')]
+        except OSError:
+            LOGGER.critical(f'Could not read realms file: "{kwargs["realms_file"]}"')
+            sys.exit(1)
 
-    realm = _check_realm_in_action(action, realm)
+    realms = list(dict.fromkeys(realms))  # remove duplicates keeping order
+    return [_check_realm_in_action(action, r) for r in (realms or [None])]
 
-    if action == 'ADD':
-        # load again an substitute the possible string templates
-        service_config = load_json_file(f'{SERVICES_PATH}/{name}.json', {
-            'host': BASE_HOST,
-            'domain': BASE_DOMAIN,
-            'realm': realm,
-            'service': service_name,
-            'name': name,
-            'service_url': service_url
-        })
 
+def handle_service(action, name, realm=None, oidc_client=None, *args, kwargs={}):
+    realms = _get_realms(action, realm, kwargs)
+    configs = {realm: _load_service_config(name, realm, kwargs) for realm in realms}
+
+    if action == 'ADD':
         if kwargs.get('test'):
-            LOGGER.debug(service_config)
+            for service_config in configs.values():
+                LOGGER.debug(service_config)
             return
 
-        add_service(service_config, realm, oidc_client)
+        force = bool(kwargs.get('force'))
+        if kwargs.get('async'):
+            results = run_async(a_add_services, [configs], oidc_client, force, kwargs=kwargs)
+        else:
+            results = add_service_realms(configs, oidc_client, force)
+        if len(realms) > 1:
+            _log_results(results)
 
     elif action == 'REMOVE':
         if not kwargs.get('test'):
-            remove_service(service_name, realm)
+            for realm, service_config in configs.items():
+                service_name = kwargs.get('service_name') or service_config['name']
+                remove_service(service_name, realm)
 
 
 def handle_solution(action, name, realm=None, oidc_client=None, *args, kwargs={}):
-    try:
-        services = load_json_file(f'{SOLUTIONS_PATH}/{name}.json').get('services', [])
-    except Exception:
-        LOGGER.critical(f'No solution definition for name: "{name}"')
-        sys.exit(1)
-
-    realm = _check_realm_in_action(action, realm)
+    services = _load_solution_services(name)
+    realms = _get_realms(action, realm, kwargs)
 
     if action == 'ADD':
-        LOGGER.info(f'Adding solution "{name}" for realm "{realm}"...')
+        for realm in realms:
+            LOGGER.info(f'Adding solution "{name}" for realm "{realm}"...')
+
+        services_configs = [
+            {realm: _load_service_config(service, realm) for realm in realms}
+            for service in services
+        ]
+        if kwargs.get('test'):
+            for configs in services_configs:
+                for service_config in configs.values():
+                    LOGGER.debug(service_config)
+            return
+
+        force = bool(kwargs.get('force'))
+        if kwargs.get('async'):
+            results = run_async(a_add_services, services_configs, oidc_client, force, kwargs=kwargs)
+        else:
+            results = add_services(services_configs, oidc_client, force)
+        _log_results(results)
 
     elif action == 'REMOVE':
-        if not realm:
-            LOGGER.info(f'Removing solution "{name}" from ALL realms...')
+        for realm in realms:
+            if not realm:
+                LOGGER.info(f'Removing solution "{name}" from ALL realms...')
+            else:
+                LOGGER.info(f'Removing solution "{name}" from realm "{realm}"...')
+
+            for service in services:
+                handle_service(action, service, realm, oidc_client)
+
+
+############################################
+#
+# Async (concurrent) provisioning
+#
+############################################
+
+async def _a_request(client, limit, **kwargs):
+    # limits the number of simultaneous Kong calls
+    async with limit:
+        return await async_request(client, **kwargs)
+
+
+async def _a_add_service_plugin(client, limit, name):
+    # Add CORS plugin for whole domain
+    PLUGIN_URL = f'{KONG_INTERNAL_URL}/services/{name}/plugins'
+    snapshot = get_snapshot()
+
+    cors_data, plugin = _get_cors_plugin_data(name)
+    if plugin:
+        # remove entry
+        _plugin_id = plugin['id']
+        await _a_request(client, limit, method='delete', url=f'{PLUGIN_URL}/{_plugin_id}')
+        snapshot.remove_plugin(_plugin_id)
+
+    snapshot.add_plugin(await _a_request(client, limit, method='post', url=PLUGIN_URL, data=cors_data))
+    LOGGER.success(f'Added CORS plugin to service "{name}"')
+
+
+async def _a_update_route(client, limit, name, route, route_data, plugin_data=None):
+    # async version of "_update_route"
+    route_name = route['name']
+    updates = _get_route_updates(route, route_data, plugin_data)
+    if not updates:
+        LOGGER.warning(f'Route "{route_name}" for service "{name}" already exists!')
+        return ROUTE_EXISTS
+
+    try:
+        for method, url, data, add_fn in updates:
+            add_fn(await _a_request(client, limit, method=method, url=url, data=data))
+        LOGGER.success(f'Updated route "{route_name}" for service "{name}"')
+        return ROUTE_EXISTS
+    except HTTPStatusError:
+        LOGGER.error(f'Could not update route "{route_name}"')
+        return ROUTE_FAILED
+
+
+async def _a_add_route(client, limit, name, route_data, plugin_data=None):
+    # the route plugin (if any) is added right after the route
+    route_name = route_data['name']
+    paths = route_data['paths']
+    snapshot = get_snapshot()
+
+    route = snapshot.get_route(route_name)
+    if route:
+        return await _a_update_route(client, limit, name, route, route_data, plugin_data)
+
+    try:
+        route_info = await _a_request(
+            client, limit,
+            method='post',
+            url=f'{KONG_INTERNAL_URL}/services/{name}/routes',
+            data=route_data,
+        )
+        snapshot.add_route(route_info)
+        LOGGER.success(f'Route paths {paths} now being served at {BASE_HOST}')
+    except HTTPStatusError:
+        LOGGER.error(f'Could not add route paths {paths}')
+        return ROUTE_FAILED
+
+    if plugin_data:
+        try:
+            snapshot.add_plugin(await _a_request(
+                client, limit,
+                method='post',
+                url=f'{KONG_INTERNAL_URL}/routes/{route_info["id"]}/plugins',
+                data=plugin_data,
+            ))
+            LOGGER.success(f'Route paths {paths} now being protected')
+        except HTTPStatusError:
+            LOGGER.error(f'Could not protect route paths {paths}')
+            return ROUTE_FAILED
+
+    return ROUTE_ADDED
+
+
+async def _a_set_hash_tags(client, limit, name, hashes):
+    tags = _get_hash_tags(name, hashes)
+    if tags is None:
+        return
+
+    try:
+        service_info = await _a_request(
+            client, limit,
+            method='patch',
+            url=f'{KONG_INTERNAL_URL}/services/{name}',
+            json={'tags': tags},
+        )
+        get_snapshot().add_service(service_info)
+    except HTTPStatusError:
+        LOGGER.warning(f'Could not update the configuration hash of service "{name}"')
+
+
+async def _a_add_service(client, limit, config, force=False):
+    name = config['name']  # service name
+    host = config['host']  # service host
+
+    config_hash = _get_service_hash(config)
+    if not force and _is_unchanged(name, config_hash):
+        LOGGER.info(f'Service "{name}" at {host} is up to date, skipping...')
+        return
+
+    LOGGER.info(f'Exposing service "{name}" at {host}...')
+    snapshot = get_snapshot()
+
+    try:
+        service = snapshot.get_service(name)
+        service_data = _get_service_data(config)
+        if not service:
+            # Register service
+            service_info = await _a_request(
+                client, limit,
+                method='post',
+                url=f'{KONG_INTERNAL_URL}/services/',
+                data=service_data,
+            )
+            snapshot.add_service(service_info)
+            LOGGER.success(f'Added service "{name}": {service_info["id"]}')
+        elif not _same_entity(_split_service_url(service_data), service):
+            snapshot.add_service(await _a_request(
+                client, limit,
+                method='patch',
+                url=f'{KONG_INTERNAL_URL}/services/{name}',
+                data=service_data,
+            ))
+            LOGGER.success(f'Updated service "{name}"')
         else:
-            LOGGER.info(f'Removing solution "{name}" from realm "{realm}"...')
+            LOGGER.warning(f'Service "{name}" already exists!')
+
+        # Add CORS plugin and the public routes (non realm dependant)
+        tasks = [_a_add_service_plugin(client, limit, name)]
+        route_data = _get_public_route_data(config)
+        if route_data:
+            tasks.append(_a_add_route(client, limit, name, route_data))
+        if ROUTE_FAILED in await asyncio.gather(*tasks):
+            return  # the configuration hash is not stored
+
+        await _a_set_hash_tags(client, limit, name, {None: config_hash})
+
+    except Exception as e:
+        LOGGER.critical(f'Could not add service "{name}"')
+        raise e
+
+
+async def _a_get_realm_oidc_data(service_config, realm, oidc_client, client_secret=None):
+    # async version of "_get_realm_oidc_data" (the OIDC client is already checked)
+    if not service_config.get(f'{EPT_OIDC}_endpoints'):
+        return {}
+
+    client_secret = client_secret or await a_get_client_secret(realm, oidc_client)
+    return _get_service_oidc_payload(service_config['name'], realm, oidc_client, client_secret)
+
+
+async def a_add_service_realms(client, limit, configs, oidc_client, force=False, client_secrets={}):
+    # async version of "add_service_realms", "client_secrets" by realm (fetched if missing)
+    service_config = next(iter(configs.values()))
+    name = service_config['name']  # service name
+
+    if service_config.get(f'{EPT_OIDC}_endpoints') and not oidc_client:
+        LOGGER.critical('Cannot execute command without OIDC client')
+        sys.exit(1)
+
+    # the client secrets are part of the configuration hashes
+    client_secrets = dict(client_secrets)
+    missing = [
+        realm
+        for realm, config in configs.items()
+        if config.get(f'{EPT_OIDC}_endpoints') and realm not in client_secrets
+    ]
+    client_secrets.update(zip(missing, await asyncio.gather(*[
+        a_get_client_secret(realm, oidc_client)
+        for realm in missing
+    ])))
+
+    # skip the unchanged realms before adding anything to Kong
+    results = {}
+    hashes = {}
+    for realm, config in configs.items():
+        hashes[realm] = _get_realm_hash(config, realm, oidc_client, client_secrets.get(realm))
+        if not force and _is_unchanged(name, hashes[realm], realm):
+            results[realm] = _get_unchanged_result(config, realm)
+    configs = {realm: config for realm, config in configs.items() if realm not in results}
+
+    # OIDC plugin settings fetched from Keycloak while the service is being registered
+    oidc_futures = {
+        realm: asyncio.ensure_future(_a_get_realm_oidc_data(config, realm, oidc_client, client_secrets.get(realm)))
+        for realm, config in configs.items()
+    }
+
+    # Register service
+    await _a_add_service(client, limit, service_config, force)
+
+    async def _add_realm_routes(realm, config):
+        oidc_data = await oidc_futures[realm]
+
+        LOGGER.info(f'Exposing service "{name}" routes for realm "{realm}"...')
+        statuses = await asyncio.gather(*[
+            _a_add_route(
+                client, limit, name, route_data,
+                _get_oidc_plugin_data(oidc_data, ep) if ep_type == EPT_OIDC else None,
+            )
+            for ep_type, ep, route_data in _get_realm_routes_data(config, realm)
+        ])
+        LOGGER.success(f'Service "{name}" routes now being served and protected for realm "{realm}"')
+        return realm, {status: statuses.count(status) for status in ROUTE_STATUSES}
+
+    results.update(await asyncio.gather(*[
+        _add_realm_routes(realm, config)
+        for realm, config in configs.items()
+    ]))
+
+    await _a_set_hash_tags(client, limit, name, {
+        realm: hashes[realm]
+        for realm in configs
+        if not results[realm][ROUTE_FAILED]
+    })
+    return results
+
+
+async def a_add_services(client, limit, services_configs, oidc_client, force=False):
+    # the client secret is fetched once per realm, before adding the services concurrently
+    realms = sorted({
+        realm
+        for configs in services_configs
+        for realm, config in configs.items()
+        if config.get(f'{EPT_OIDC}_endpoints')
+    }) if oidc_client else []
+    client_secrets = dict(zip(realms, await asyncio.gather(*[
+        a_get_client_secret(realm, oidc_client)
+        for realm in realms
+    ])))
+
+    results = {}
+    for result in await asyncio.gather(*[
+        a_add_service_realms(client, limit, configs, oidc_client, force, client_secrets)
+        for configs in services_configs
+    ]):
+        _merge_results(results, result)
+    return results
+
+
+def run_async(fn, *args, kwargs={}, snapshot=True):
+    concurrency = int(kwargs.get('concurrency') or KONG_CONCURRENCY)
+    if snapshot:
+        get_snapshot()  # load it before starting
+
+    async def _main():
+        limit = asyncio.Semaphore(concurrency)
+        async with get_async_client() as client:
+            return await fn(client, limit, *args)
+
+    return asyncio.run(_main())
+
+
+############################################
+#
+# Realm teardown
+#
+############################################
+
+# progress is reported every N removed routes
+TEARDOWN_PROGRESS_STEP = 50
+
+
+def _get_realm_routes(realm):
+    if SNAPSHOT is not None:
+        return SNAPSHOT.get_routes_by_realm(realm)
+
+    # the realm routes are tagged with the realm, the old ones (without tags)
+    # have the realm as name suffix, a realm can have both (same as KongSnapshot);
+    # the teardown must find both so it reads all the routes, the lookups use the tags
+    def _in_realm(route):
+        if route.get('tags') is not None:
+            return realm in route['tags']
+        return '__' in (route.get('name') or '') and route['name'].rsplit('__', 1)[-1] == realm
+
+    return [route for route in get_all(f'{KONG_INTERNAL_URL}/routes') if _in_realm(route)]
+
+
+async def a_remove_realm_routes(client, limit, realm, routes):
+    # Kong removes the route plugins (OIDC) along with the route
+    total = len(routes)
+    removed = []
+    failed = []
+    start = time.monotonic()
+
+    async def _remove_route(route):
+        route_name = route.get('name') or route['id']
+        try:
+            await _a_request(client, limit, method='delete', url=f'{KONG_INTERNAL_URL}/routes/{route["id"]}')
+            removed.append(route)
+            if SNAPSHOT is not None:
+                SNAPSHOT.remove_route(route['id'])
+            LOGGER.verbose(f'Removed route "{route_name}" ({route["id"]})')
+        except HTTPStatusError:
+            failed.append(route)
+            LOGGER.warning(f'Could not remove route "{route_name}"')
+
+        done = len(removed) + len(failed)
+        if done % TEARDOWN_PROGRESS_STEP == 0 and done < total:
+            elapsed = time.monotonic() - start
+            LOGGER.info(f'Realm "{realm}": {done}/{total} routes removed ({done / elapsed:.1f} routes/s)')
+
+    await asyncio.gather(*[_remove_route(route) for route in routes])
+    return removed, failed, time.monotonic() - start
+
+
+async def a_clear_realm_hash_tags(client, limit, realm, service_ids):
+    # the configuration hashes of the realm are not valid anymore
+    prefix = _get_hash_tag_prefix(realm)
+    services = [
+        service
+        for service in get_all(f'{KONG_INTERNAL_URL}/services')
+        if service['id'] in service_ids
+        and any(tag.startswith(prefix) for tag in service.get('tags') or [])
+    ]
+
+    async def _clear(service):
+        tags = [tag for tag in service['tags'] if not tag.startswith(prefix)]
+        try:
+            service_info = await _a_request(
+                client, limit,
+                method='patch',
+                url=f'{KONG_INTERNAL_URL}/services/{service["id"]}',
+                json={'tags': tags},
+            )
+            if SNAPSHOT is not None:
+                SNAPSHOT.add_service(service_info)
+        except HTTPStatusError:
+            LOGGER.warning(f'Could not update the configuration hash of service "{service["name"]}"')
+
+    await asyncio.gather(*[_clear(service) for service in services])
+
+
+async def a_remove_realm(client, limit, realm):
+    LOGGER.info(f'Removing realm "{realm}" from ALL services...')
+
+    routes = _get_realm_routes(realm)
+    if not routes:
+        LOGGER.warning(f'Realm "{realm}" has no routes!')
+        return
+
+    LOGGER.info(f'Realm "{realm}": removing {len(routes)} routes...')
+    removed, failed, elapsed = await a_remove_realm_routes(client, limit, realm, routes)
+
+    service_ids = {(route.get('service') or {}).get('id') for route in removed}
+    await a_clear_realm_hash_tags(client, limit, realm, service_ids)
+
+    summary = (
+        f'Realm "{realm}": {len(removed)} routes removed from {len(service_ids)} services,'
+        f' {len(failed)} failed in {elapsed:.2f}s ({len(removed) / max(elapsed, 0.001):.1f} routes/s)'
+    )
+    if failed:
+        LOGGER.error(summary)
+    else:
+        LOGGER.success(summary)
+
+
+def remove_realm(realms, concurrency=None):
+    # the services and their public routes are kept, they are not realm dependant
+
+    async def _remove_realms(client, limit):
+        for realm in realms:
+            await a_remove_realm(client, limit, realm)
+
+    run_async(_remove_realms, kwargs={'concurrency': concurrency}, snapshot=False)
+
+
+def handle_realm(action, realm=None, *args, kwargs={}):
+    if action != 'REMOVE':
+        LOGGER.critical(f'No action for realm: {action}')
+        sys.exit(1)
+
+    realms = _get_realms('ADD', realm, kwargs)  # realm required, "*" is not valid here
+    if kwargs.get('test'):
+        for realm in realms:
+            LOGGER.debug(f'Removing realm "{realm}"...')
+        return
+
+    remove_realm(realms, kwargs.get('concurrency'))
+
+
+############################################
+#
+# Reconcile (declarative diff-and-apply)
+#
+############################################
+
+def _list_definitions(path):
+    try:
+        return sorted(f[:-len('.json')] for f in os.listdir(path) if f.endswith('.json'))
+    except OSError:
+        return []
+
+
+def _find_plugin(snapshot, plugin_name, target_type, target):
+    if target_type == 'service':
+        plugins = snapshot.get_service_plugins(target)
+    else:
+        plugins = snapshot.get_route_plugins(target)
+    return next((p for p in plugins if p['name'] == plugin_name), None)
+
+
+def _get_definitions(realms, kwargs={}):
+    # returns the list of apps and services indicated in the arguments
+    def _names(key):
+        return [i for i in (kwargs.get(key) or '').split(',') if i]
+
+    apps = _names('apps')
+    services = _names('services')
+    solutions = _names('solutions')
+    if not (apps or services or solutions):
+        # take all the available definitions
+        apps = _list_definitions(APPS_PATH)
+        solutions = _list_definitions(SOLUTIONS_PATH) if realms else []
+
+    for solution in solutions:
+        services += _load_solution_services(solution)
+    services = list(dict.fromkeys(services))  # remove duplicates keeping order
+
+    if services and not realms:
+        LOGGER.critical('Cannot execute command without realm')
+        sys.exit(1)
+
+    return apps, services
+
+
+def _get_desired_state(apps, services, realms, oidc_client, kwargs={}):
+    state = {
+        'services': {},
+        'routes': {},
+        'plugins': {},
+        'hashes': {},  # service name -> {realm: configuration hash}, see "_set_hash_tags"
+    }
+
+    def _add_config(config):
+        name = config['name']
+        state['services'][name] = _get_service_data(config)
+        state['hashes'].setdefault(name, {})[None] = _get_service_hash(config)
+
+        cors_data = load_json_file(TEMPLATES['cors'], {'host': BASE_HOST})
+        state['plugins'][(cors_data['name'], 'service', name)] = cors_data
+
+        route_data = _get_public_route_data(config)
+        if route_data:
+            state['routes'][route_data['name']] = (name, route_data)
+
+    for app in apps:
+        _add_config(_load_app_config(app))
 
     for service in services:
-        handle_service(action, service, realm, oidc_client)
+        for realm in realms:
+            service_config = _load_service_config(service, realm, kwargs)
+            _add_config(service_config)
+            name = service_config['name']
+
+            client_secret = _get_realm_client_secret(service_config, realm, oidc_client)
+            state['hashes'][name][realm] = _get_realm_hash(service_config, realm, oidc_client, client_secret)
+
+            oidc_data = _get_realm_oidc_data(service_config, realm, oidc_client)
+            for ep_type, ep, route_data in _get_realm_routes_data(service_config, realm):
+                route_name = route_data['name']
+                state['routes'][route_name] = (name, route_data)
+
+                if ep_type == EPT_OIDC:
+                    plugin_data = _get_oidc_plugin_data(oidc_data, ep)
+                    state['plugins'][(plugin_data['name'], 'route', route_name)] = plugin_data
+
+    return state
+
+
+def _same_value(expected, value):
+    if isinstance(value, bool):
+        return str(expected).lower() == str(value).lower()
+    if isinstance(value, list):
+        # Kong splits the comma separated strings into arrays
+        if isinstance(expected, str):
+            expected = [i.strip() for i in expected.split(',')]
+        return sorted(map(str, expected)) == sorted(map(str, value))
+    if value is None:
+        return expected in (None, '')
+    return str(expected) == str(value)
+
+
+def _same_entity(expected, current):
+    for key, value in expected.items():
+        if key.startswith('config.'):
+            current_value = (current.get('config') or {}).get(key[len('config.'):])
+        else:
+            current_value = current.get(key)
+        if not _same_value(value, current_value):
+            return False
+    return True
+
+
+def _split_service_url(service_data):
+    # Kong stores the service url split in its components
+    data = dict(service_data)
+    url = urlsplit(data.pop('url'))
+    data['protocol'] = url.scheme
+    data['host'] = url.hostname
+    data['port'] = url.port or (443 if url.scheme == 'https' else 80)
+    data['path'] = url.path or None
+    return data
+
+
+def _diff_state(desired, snapshot, realms):
+    # returns the list of operations as (method, url, data, description)
+    operations = []
+
+    for name, service_data in desired['services'].items():
+        service = snapshot.get_service(name)
+        if not service:
+            operations.append((
+                'post', f'{KONG_INTERNAL_URL}/services/', service_data,
+                f'Add service "{name}"',
+            ))
+        elif not _same_entity(_split_service_url(service_data), service):
+            operations.append((
+                'patch', f'{KONG_INTERNAL_URL}/services/{name}', service_data,
+                f'Update service "{name}"',
+            ))
+
+    # remove the routes of the handled services assigned to this host and realms
+    # that are no longer defined
+    scope = {BASE_DOMAIN, *realms}
+    for route in list(snapshot.routes.values()):
+        route_name = route.get('name')
+        if snapshot.get_service_name(route) not in desired['services'] or route_name in desired['routes']:
+            continue
+        tags = set(route.get('tags') or [])
+        if BASE_DOMAIN in tags and tags <= scope:
+            operations.append((
+                'delete', f'{KONG_INTERNAL_URL}/routes/{route["id"]}', None,
+                f'Remove route "{route_name}"',
+            ))
+
+    for route_name, (name, route_data) in desired['routes'].items():
+        route = snapshot.get_route(route_name)
+        service_name = snapshot.get_service_name(route) if route else None
+        if not route:
+            operations.append((
+                'post', f'{KONG_INTERNAL_URL}/services/{name}/routes', route_data,
+                f'Add route "{route_name}"',
+            ))
+        elif service_name != name:
+            # assigned to another service, move it
+            operations.append((
+                'delete', f'{KONG_INTERNAL_URL}/routes/{route["id"]}', None,
+                f'Remove route "{route_name}" from service "{service_name}"',
+            ))
+            operations.append((
+                'post', f'{KONG_INTERNAL_URL}/services/{name}/routes', route_data,
+                f'Add route "{route_name}"',
+            ))
+        elif not _same_entity(route_data, route):
+            operations.append((
+                'patch', f'{KONG_INTERNAL_URL}/routes/{route["id"]}', route_data,
+                f'Update route "{route_name}"',
+            ))
+
+    for key, plugin_data in desired['plugins'].items():
+        plugin_name, target_type, target = key
+        plugin = _find_plugin(snapshot, *key)
+
+        if plugin and plugin_name == 'cors':
+            # keep the origins already registered by other hosts
+            origins = plugin_data['config.origins']
+            if isinstance(origins, str):
+                origins = [origins, ]
+            plugin_data = dict(plugin_data)
+            plugin_data['config.origins'] = sorted(set(origins + plugin['config']['origins']))
+
+        if not plugin:
+            operations.append((
+                'post', f'{KONG_INTERNAL_URL}/{target_type}s/{target}/plugins', plugin_data,
+                f'Add plugin "{plugin_name}" to {target_type} "{target}"',
+            ))
+        elif not _same_entity(plugin_data, plugin):
+            operations.append((
+                'patch', f'{KONG_INTERNAL_URL}/plugins/{plugin["id"]}', plugin_data,
+                f'Update plugin "{plugin_name}" of {target_type} "{target}"',
+            ))
+
+    return operations
+
+
+def _diff_hash_tags(desired, snapshot):
+    # the configuration hashes of the "add_*" commands, so they skip the reconciled services
+    # returns the list of (url, tags, description)
+    operations = []
+    for name, hashes in desired['hashes'].items():
+        service = snapshot.get_service(name)
+        tags = _replace_hash_tags((service or {}).get('tags') or [], hashes)
+        if tags is not None:
+            operations.append((
+                f'{KONG_INTERNAL_URL}/services/{name}', tags,
+                f'Update configuration hash of service "{name}"',
+            ))
+    return operations
+
+
+def _estimate_legacy_calls(desired, snapshot):
+    # admin calls done by the "add_app", "add_service" and "add_solution" commands
+    calls = 0
+    for name in desired['services']:
+        calls += 1 if snapshot.get_service(name) else 2  # check (+ add)
+        cors = _find_plugin(snapshot, 'cors', 'service', name)
+        calls += 3 if cors else 2  # list plugins + (remove) + add
+
+    for route_name in desired['routes']:
+        calls += 1 if snapshot.get_route(route_name) else 2  # check (+ add)
+
+    for plugin_name, target_type, target in desired['plugins']:
+        if target_type == 'route' and not snapshot.get_route(target):
+            calls += 1  # add (only along with the route)
+
+    return calls
+
+
+def reconcile(realm=None, oidc_client=None, *args, kwargs={}):
+    realms = [r for r in _get_realms(None, realm, kwargs) if r]
+    apps, services = _get_definitions(realms, kwargs)
+
+    LOGGER.info(f'Reconciling apps {apps} and services {services} for realms {realms}...')
+    if kwargs.get('test'):
+        return
+
+    desired = _get_desired_state(apps, services, realms, oidc_client, kwargs)
+
+    stats = {'calls': 0}
+
+    def _request(**kw):
+        stats['calls'] += 1
+        return request(**kw)
+
+    snapshot = KongSnapshot(request_fn=_request).load()
+    operations = _diff_state(desired, snapshot, realms)
+    tag_operations = _diff_hash_tags(desired, snapshot)
+
+    summary = {'post': 0, 'patch': 0, 'delete': 0}
+    failed = 0
+    for method, url, data, description in operations:
+        summary[method] += 1
+        if kwargs.get('dry_run'):
+            LOGGER.notice(f'[dry run] {description}')
+            continue
+
+        try:
+            _request(method=method, url=url, data=data)
+            LOGGER.success(description)
+        except HTTPError:
+            LOGGER.error(f'Could not execute: {description}')
+            failed += 1
+
+    # the hashes are stored only if everything was applied
+    for url, tags, description in tag_operations:
+        if kwargs.get('dry_run'):
+            LOGGER.notice(f'[dry run] {description}')
+        elif failed:
+            LOGGER.warning(f'Skipped: {description}')
+        else:
+            try:
+                # JSON payload to be able to empty the list
+                _request(method='patch', url=url, json={'tags': tags})
+                LOGGER.debug(description)
+            except HTTPError:
+                LOGGER.warning(f'Could not execute: {description}')
+
+    legacy_calls = _estimate_legacy_calls(desired, snapshot)
+    LOGGER.success(
+        f'Reconciled Kong: {summary["post"]} created, {summary["patch"]} updated, '
+        f'{summary["delete"]} removed'
+    )
+    LOGGER.info(
+        f'Admin calls: {stats["calls"]} '
+        f'(per entity commands: ~{legacy_calls}, saved: ~{max(legacy_calls - stats["calls"], 0)})'
+    )
+
+
+############################################
+#
+# Declarative configuration (DB-less)
+#
+############################################
+
+def _to_declarative(data):
+    # converts the admin API (form) payload into a declarative entity,
+    # in DB-less mode Kong does not coerce the string values
+    entity = {}
+    for key, value in data.items():
+        target = entity
+        if key.startswith('config.'):
+            key = key[len('config.'):]
+            target = entity.setdefault('config', {})
+
+        if isinstance(value, str):
+            if value in ('true', 'false'):
+                value = value == 'true'
+            elif key in DECLARATIVE_ARRAY_FIELDS:
+                value = [i.strip() for i in value.split(',')]
+            elif key in DECLARATIVE_NUMBER_FIELDS and value.lstrip('-').isdigit():
+                value = int(value)
+        target[key] = value
+    return entity
+
+
+def get_declarative_config(desired):
+    services = {}
+    routes = {}
+
+    for name, service_data in desired['services'].items():
+        services[name] = {**_to_declarative(service_data), 'routes': [], 'plugins': []}
+
+    for route_name, (name, route_data) in desired['routes'].items():
+        routes[route_name] = {**_to_declarative(route_data), 'plugins': []}
+        services[name]['routes'].append(routes[route_name])
+
+    for (plugin_name, target_type, target), plugin_data in desired['plugins'].items():
+        entity = services[target] if target_type == 'service' else routes[target]
+        entity['plugins'].append(_to_declarative(plugin_data))
+
+    return {
+        '_format_version': KONG_DECLARATIVE_FORMAT_VERSION,
+        'services': list(services.values()),
+    }
+
+
+def compile_config(realm=None, oidc_client=None, *args, kwargs={}):
+    realms = [r for r in _get_realms(None, realm, kwargs) if r]
+    apps, services = _get_definitions(realms, kwargs)
+
+    LOGGER.info(f'Compiling apps {apps} and services {services} for realms {realms}...')
+    if kwargs.get('test'):
+        return
+
+    desired = _get_desired_state(apps, services, realms, oidc_client, kwargs)
+    content = json.dumps(get_declarative_config(desired), indent=2)
+
+    # Kong reads the declarative configuration in JSON format too
+    output = kwargs.get('output') or (None if kwargs.get('push') else 'kong.json')
+    if output:
+        with open(output, 'w') as _f:
+            _f.write(content)
+        LOGGER.success(f'Declarative configuration written in "{output}"')
+
+    if kwargs.get('push'):
+        # replaces the whole Kong configuration at once
+        request(method='post', url=f'{KONG_INTERNAL_URL}/config', data={'config': content})
+        LOGGER.success(
+            f'Declarative configuration loaded in Kong: {len(desired["services"])} services,'
+            f' {len(desired["routes"])} routes, {len(desired["plugins"])} plugins'
+        )
 
 
 def is_kong_ready():
@@ -444,6 +1547,9 @@ if __name__ == '__main__':
         'APP': handle_app,
         'SERVICE': handle_service,
         'SOLUTION': handle_solution,
+        'RECONCILE': reconcile,
+        'COMPILE': compile_config,
+        'REALM': handle_realm,
     }
 
     args, kwargs = categorize_arguments(sys.argv[:])
@@ -453,12 +1559,17 @@ if __name__ == '__main__':
         sys.exit(1)
 
     try:
-        if not kwargs.get('test'):
+        # the configuration can be compiled without Kong, only pushing it needs Kong
+        offline = command.upper() == 'COMPILE' and not kwargs.get('push')
+        if not kwargs.get('test') and not offline:
             is_kong_ready()
 
         fn = COMMANDS[command]
         args = args[2:]
         fn(*args, kwargs=kwargs or {})
+        log_connection_stats(LOGGER)
+        log_template_stats(LOGGER)
+        log_admin_stats(LOGGER)
     except Exception as e:
         LOGGER.error(str(e))
         sys.exit(1)
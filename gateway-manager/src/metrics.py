@@ -0,0 +1,341 @@
+# Copyright (C) 2020 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bisect import bisect_left
+from threading import Lock, Thread
+from urllib.parse import urlsplit
+
+from settings import METRICS_FILE
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    values = [
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    ]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in values) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def get_backend(url):
+    # metrics label of the called service, e.g. "kong:8001"
+    return urlsplit(url or '').netloc or 'unknown'
+
+
+class Counter:
+    '''
+    Monotonic counter by labels.
+    '''
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = Lock()
+        self._values = {}  # label values -> value
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            return [
+                (self.name, dict(zip(self.labels, key)), value)
+                for key, value in self._values.items()
+            ]
+
+
+class Histogram:
+    '''
+    Observations (durations in seconds) by labels, grouped in cumulative buckets.
+    '''
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = Lock()
+        self._values = {}  # label values -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            index = bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def observe_since(self, start, **labels):
+        self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = dict(zip(self.labels, key))
+                cumulative = 0
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f'{self.name}_bucket', {**labels, 'le': _format_value(bucket)}, cumulative))
+                samples.append((f'{self.name}_bucket', {**labels, 'le': '+Inf'}, count))
+                samples.append((f'{self.name}_sum', labels, total))
+                samples.append((f'{self.name}_count', labels, count))
+        return samples
+
+
+class Registry:
+    '''
+    Process metrics in the Prometheus text format.
+
+    Besides the counters and histograms, the collectors report the stats
+    already kept by the modules (caches, connections...) when rendering,
+    they return a list of (name, kind, description, [(labels, value)]).
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics = {}     # name -> metric
+        self._collectors = []
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description, labels=()):
+        return self._add(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, description, labels, buckets))
+
+    def collector(self, fn):
+        with self._lock:
+            self._collectors.append(fn)
+        return fn
+
+    def collect(self):
+        # name -> (kind, description, samples)
+        families = {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        for metric in metrics:
+            families[metric.name] = (metric.kind, metric.description, metric.samples())
+        for collector in collectors:
+            for name, kind, description, values in collector():
+                family = families.setdefault(name, (kind, description, []))
+                family[2].extend((name, labels, value) for labels, value in values)
+        return families
+
+    def render(self, families=None):
+        lines = []
+        for name, (kind, description, samples) in sorted((self.collect() if families is None else families).items()):
+            if not samples:
+                continue
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines += [
+                f'{sample_name}{_format_labels(labels)} {_format_value(value)}'
+                for sample_name, labels, value in samples
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+class WorkerMetrics:
+    '''
+    Registry of the forked worker processes of a server, merged when rendering.
+
+    Each worker writes its metrics to "{path}/{pid}.json" every "interval"
+    seconds, before rendering and at exit. The counters and histograms are the
+    sum of all the files, the ones of the finished workers are kept so the
+    totals never go backwards; the gauges are reported by worker ("pid" label)
+    and removed with the worker.
+
+    Without "path" (single process) the registry is rendered as it is.
+    '''
+
+    def __init__(self, registry, interval=5):
+        self.registry = registry
+        self.interval = interval
+        self.path = None
+        self._writer = None
+
+    def _get_file(self, pid):
+        return os.path.join(self.path, f'{pid}.json')
+
+    def _write(self, pid, families):
+        # atomic, the file is never read half written
+        file_path = self._get_file(pid)
+        with open(f'{file_path}.tmp', 'w') as _f:
+            json.dump(families, _f)
+        os.replace(f'{file_path}.tmp', file_path)
+
+    def _write_all(self):
+        while True:
+            time.sleep(self.interval)
+            self.write()
+
+    def setup(self):
+        # in the main process, before forking the workers
+        self.path = tempfile.mkdtemp(prefix='gwm-metrics-')
+        return self
+
+    def start(self):
+        # in each worker, after the fork
+        if self.path and not self._writer:
+            self._writer = Thread(target=self._write_all, daemon=True)
+            self._writer.start()
+
+    def write(self):
+        if self.path:
+            self._write(os.getpid(), self.registry.collect())
+
+    def remove_worker(self, pid):
+        # the counters of the finished worker still count, not its gauges
+        try:
+            with open(self._get_file(pid)) as _f:
+                families = json.load(_f)
+        except (OSError, ValueError):
+            return
+        self._write(pid, {
+            name: family
+            for name, family in families.items()
+            if family[0] != 'gauge'
+        })
+
+    def clear(self):
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def collect(self):
+        if not self.path:
+            return self.registry.collect()
+
+        self.write()
+        families = {}  # name -> (kind, description, {(sample name, labels): value})
+        for file_name in sorted(os.listdir(self.path)):
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.path, file_name)) as _f:
+                    worker_families = json.load(_f)
+            except (OSError, ValueError):
+                continue
+
+            pid = file_name[:-len('.json')]
+            for name, (kind, description, samples) in worker_families.items():
+                values = families.setdefault(name, (kind, description, {}))[2]
+                for sample_name, labels, value in samples:
+                    if kind == 'gauge':
+                        labels = {**labels, 'pid': pid}
+                    key = (sample_name, tuple(labels.items()))
+                    values[key] = values.get(key, 0) + value
+
+        return {
+            name: (kind, description, [
+                (sample_name, dict(labels), value)
+                for (sample_name, labels), value in values.items()
+            ])
+            for name, (kind, description, values) in families.items()
+        }
+
+    def render(self):
+        return self.registry.render(self.collect())
+
+
+REGISTRY = Registry()
+
+# shared by all the modules
+HTTP_REQUESTS = REGISTRY.counter(
+    'gwm_http_requests_total',
+    'Calls to the admin APIs by backend, method and response status.',
+    ['backend', 'method', 'status'],
+)
+HTTP_DURATION = REGISTRY.histogram(
+    'gwm_http_request_duration_seconds',
+    'Duration of the calls to the admin APIs by backend and method.',
+    ['backend', 'method'],
+)
+
+
+def observe_request(url, method, status, start):
+    backend = get_backend(url)
+    method = str(method).upper()
+    HTTP_REQUESTS.inc(backend=backend, method=method, status=status)
+    HTTP_DURATION.observe_since(start, backend=backend, method=method)
+
+
+def get_cache_metrics(caches):
+    # caches: {name: {'hits': n, 'misses': n}}
+    return [
+        (
+            'gwm_cache_hits_total', 'counter', 'Cache hits by cache.',
+            [({'cache': name}, stats['hits']) for name, stats in caches.items()],
+        ),
+        (
+            'gwm_cache_misses_total', 'counter', 'Cache misses by cache.',
+            [({'cache': name}, stats['misses']) for name, stats in caches.items()],
+        ),
+        (
+            'gwm_cache_hit_ratio', 'gauge', 'Ratio of cache hits by cache.',
+            [
+                ({'cache': name}, stats['hits'] / (stats['hits'] + stats['misses']))
+                for name, stats in caches.items()
+                if stats['hits'] + stats['misses']
+            ],
+        ),
+    ]
+
+
+def dump_metrics(file_path=METRICS_FILE):
+    # "-" writes to the standard output
+    if file_path == '-':
+        sys.stdout.write(REGISTRY.render())
+        sys.stdout.flush()
+    else:
+        with open(file_path, 'w') as _f:
+            _f.write(REGISTRY.render())
+
+
+if METRICS_FILE:
+    # the one-shot commands dump the metrics at exit
+    atexit.register(dump_metrics)
@@ -34,6 +34,9 @@ APPS_PATH = get_env('APPS_PATH', '/code/app')
 SERVICES_PATH = get_env('SERVICES_PATH', '/code/service')
 SOLUTIONS_PATH = get_env('SOLUTIONS_PATH', '/code/solution')
 SERVICES_DATA_PATH = get_env('SERVICES_DATA_PATH', '/code/data/services.json')
+STATIC_PATH = get_env('STATIC_PATH', '/code/static')
+# fingerprinted (content hashed) copies of the static files
+STATIC_BUILD_PATH = get_env('STATIC_BUILD_PATH', '/var/tmp/static')
 
 _TEMPLATES_PATH = get_env('TEMPLATES_PATH', '/code/templates')
 TEMPLATES = {
@@ -71,12 +74,36 @@ TEMPLATES = {
 }
 
 
+# HTTP connections (Kong, ElasticSearch...)
+
+HTTP_POOL_SIZE = int(get_env('HTTP_POOL_SIZE', 10))
+HTTP_KEEP_ALIVE = get_env('HTTP_KEEP_ALIVE', 'true').lower() != 'false'
+HTTP_CONNECT_TIMEOUT = float(get_env('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(get_env('HTTP_READ_TIMEOUT', 60))
+
+
+# Metrics
+
+# file to dump the metrics at exit (Prometheus text format), "-" for the standard output
+METRICS_FILE = get_env('METRICS_FILE')
+
+
 # Keycloak Information
 
 KC_ADMIN_URL = get_env('KEYCLOAK_INTERNAL')     # http://keycloak:8080/
 KC_ADMIN_USER = get_env('KEYCLOAK_GLOBAL_ADMIN')
 KC_ADMIN_PASSWORD = get_env('KEYCLOAK_GLOBAL_PASSWORD')
 KC_ADMIN_REALM = get_env('KEYCLOAK_MASTER_REALM', 'master')
+# number of retries (clearing the realm cache) after an authentication failure
+KC_CACHE_RETRIES = int(get_env('KEYCLOAK_CACHE_RETRIES', 1))
+# maximum number of simultaneous Keycloak admin calls (bulk commands)
+KC_CONCURRENCY = int(get_env('KEYCLOAK_CONCURRENCY', 10))
+# seconds to keep the realm clients, groups and roles lookups
+KC_LOOKUP_TTL = float(get_env('KEYCLOAK_LOOKUP_TTL', 300))
+# seconds to keep the OIDC client secrets (only in memory)
+KC_SECRET_TTL = float(get_env('KEYCLOAK_SECRET_TTL', 300))
+# seconds before refreshing (in background) the realm names shown in the landing pages
+KC_REALM_TTL = float(get_env('KEYCLOAK_REALM_TTL', 60))
 
 
 # Kong Information
@@ -84,6 +111,8 @@ KC_ADMIN_REALM = get_env('KEYCLOAK_MASTER_REALM', 'master')
 KONG_INTERNAL_URL = get_env('KONG_INTERNAL')    # http://kong:8001
 KONG_PUBLIC_REALM = get_env('PUBLIC_REALM', '-')
 KONG_TOKEN_HEADER = get_env('KONG_TOKEN_HEADER', 'X-Oauth-Token')
+# maximum number of simultaneous Kong admin calls (async mode)
+KONG_CONCURRENCY = int(get_env('KONG_CONCURRENCY', 10))
 
 
 # Kafka && Zookeeper
@@ -115,6 +144,27 @@ ES_PW = get_env('ELASTICSEARCH_PW')
 
 WEB_SERVICE_NAME = get_env('WEB_SERVICE_NAME', 'gateway')
 WEB_SERVER_PORT = get_env('WEB_SERVER_PORT', 8007)
+# "production" (preforking WSGI server) or "development" (Flask server)
+WEB_SERVER_MODE = get_env('WEB_SERVER_MODE', 'production')
+WEB_WORKERS = int(get_env('WEB_WORKERS', 2))
+WEB_THREADS = int(get_env('WEB_THREADS', 4))
+# seconds before killing (and restarting) a blocked worker
+WEB_TIMEOUT = int(get_env('WEB_TIMEOUT', 30))
+# seconds given to the workers to finish their requests on restart
+WEB_GRACEFUL_TIMEOUT = int(get_env('WEB_GRACEFUL_TIMEOUT', 30))
+# seconds before refreshing (in background) the landing page data of a realm
+WEB_CACHE_TTL = float(get_env('WEB_CACHE_TTL', 30))
+# seconds between background refreshes of all the cached realms (0 to disable)
+WEB_REFRESH_INTERVAL = float(get_env('WEB_REFRESH_INTERVAL', 300))
+# seconds to wait for the landing page lookups, after that the page is rendered with fallback values
+WEB_KONG_TIMEOUT = float(get_env('WEB_KONG_TIMEOUT', 2))
+WEB_KEYCLOAK_TIMEOUT = float(get_env('WEB_KEYCLOAK_TIMEOUT', 2))
+# threads of each worker for the landing page lookups (the timed out ones keep their thread until done)
+WEB_LOOKUP_WORKERS = int(get_env('WEB_LOOKUP_WORKERS', 8))
+# bearer token required by the metrics endpoint (disabled if not set)
+WEB_METRICS_TOKEN = get_env('WEB_METRICS_TOKEN')
+# seconds between the metrics dumps of each worker, merged by the metrics endpoint
+WEB_METRICS_INTERVAL = float(get_env('WEB_METRICS_INTERVAL', 5))
 
 
 # Version and revision
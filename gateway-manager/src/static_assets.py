@@ -0,0 +1,132 @@
+# Copyright (C) 2020 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from helpers import get_logger
+from settings import STATIC_BUILD_PATH, STATIC_PATH
+
+HASH_LENGTH = 16
+MANIFEST_FILE = 'manifest.json'
+# only the text files are worth compressing (the images are already compressed)
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+    'image/vnd.microsoft.icon',
+    'image/x-icon',
+)
+
+LOGGER = get_logger('Static')
+
+
+def _get_file_hash(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as _f:
+        for chunk in iter(lambda: _f.read(65536), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()[:HASH_LENGTH]
+
+
+def _get_fingerprinted_name(name, file_hash):
+    # "css/landing-page.css" -> "css/landing-page.{hash}.css"
+    root, ext = os.path.splitext(name)
+    return f'{root}.{file_hash}{ext}'
+
+
+def _is_compressible(name):
+    mimetype = mimetypes.guess_type(name)[0] or ''
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+class StaticAssets:
+    '''
+    Content hashed copies of the static files.
+
+    The build copies each file as "{name}.{hash}{ext}" (with a gzipped
+    version next to it if it is smaller) and writes a manifest with the
+    original names. The hashed names never change their content so they can
+    be cached forever by the browsers.
+    '''
+
+    def __init__(self, source_path=STATIC_PATH, build_path=STATIC_BUILD_PATH):
+        self.source_path = source_path
+        self.build_path = build_path
+        self.manifest = {}  # name -> fingerprinted name
+        self.assets = {}    # fingerprinted name -> {'name', 'hash', 'gzip'}
+
+    def _set_manifest(self, manifest):
+        self.manifest = {name: asset['path'] for name, asset in manifest.items()}
+        self.assets = {
+            asset['path']: {'name': name, 'hash': asset['hash'], 'gzip': asset['gzip']}
+            for name, asset in manifest.items()
+        }
+
+    def build(self):
+        manifest = {}
+        for root, _, files in os.walk(self.source_path):
+            for file_name in sorted(files):
+                source = os.path.join(root, file_name)
+                name = os.path.relpath(source, self.source_path).replace(os.sep, '/')
+                file_hash = _get_file_hash(source)
+                path = _get_fingerprinted_name(name, file_hash)
+                target = os.path.join(self.build_path, path)
+
+                # the existing files have the same content
+                if not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.copyfile(source, target)
+
+                compressed = _is_compressible(name)
+                if compressed and not os.path.exists(f'{target}.gz'):
+                    with open(source, 'rb') as _f:
+                        content = _f.read()
+                    data = gzip.compress(content, compresslevel=9, mtime=0)
+                    compressed = len(data) < len(content)
+                    if compressed:
+                        with open(f'{target}.gz', 'wb') as _f:
+                            _f.write(data)
+
+                manifest[name] = {'path': path, 'hash': file_hash, 'gzip': compressed}
+
+        os.makedirs(self.build_path, exist_ok=True)
+        with open(os.path.join(self.build_path, MANIFEST_FILE), 'w') as _f:
+            json.dump(manifest, _f, indent=2, sort_keys=True)
+
+        self._set_manifest(manifest)
+        LOGGER.debug(f'Built {len(manifest)} static files in {self.build_path}')
+        return self
+
+    def get_path(self, name):
+        # fingerprinted name of the file, the same name if not found
+        return self.manifest.get(name.lstrip('/'), name)
+
+    def get_asset(self, path):
+        # file info of the fingerprinted name
+        return self.assets.get(path)
+
+
+def build_static():
+    StaticAssets().build()
+    LOGGER.success('Static files built!')
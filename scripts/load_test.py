@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2020 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# Simple load test for the gateway home app (no dependencies).
+#
+# Usage:
+#   ./scripts/load_test.py <url> [clients=20] [seconds=10]
+#
+# Example:
+#   WEB_SERVER_MODE=development ./entrypoint.sh start_app &
+#   ./scripts/load_test.py http://localhost:8007/dev/ 50 20
+#
+
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.request import urlopen
+
+
+def _client(url, until):
+    latencies = []
+    errors = 0
+    while time.monotonic() < until:
+        start = time.monotonic()
+        try:
+            with urlopen(url, timeout=30) as response:
+                response.read()
+            latencies.append(time.monotonic() - start)
+        except (URLError, OSError):
+            errors += 1
+    return latencies, errors
+
+
+def _percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else 0
+
+
+def load_test(url, clients=20, seconds=10):
+    start = time.monotonic()
+    until = start + seconds
+    with ThreadPoolExecutor(clients) as executor:
+        results = list(executor.map(lambda _: _client(url, until), range(clients)))
+    elapsed = time.monotonic() - start
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    print(f'{url}: {clients} clients, {elapsed:.1f}s')
+    print(f'  requests: {len(latencies)} ({len(latencies) / elapsed:.1f} req/s), errors: {errors}')
+    print(
+        f'  latency: p50 {_percentile(latencies, 50) * 1000:.1f}ms,'
+        f' p95 {_percentile(latencies, 95) * 1000:.1f}ms,'
+        f' p99 {_percentile(latencies, 99) * 1000:.1f}ms'
+    )
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: load_test.py <url> [clients] [seconds]')
+        sys.exit(1)
+
+    load_test(
+        sys.argv[1],
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 10,
+    )